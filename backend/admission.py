@@ -0,0 +1,181 @@
+# /admission.py
+"""
+Admission control for the OCR upload endpoint.
+
+Before enqueueing, the API checks the depth of the task's broker queue and the
+number of OCR jobs the user still has in flight. Both are read from Redis and
+cached for ADMISSION_CACHE_SECONDS so the check is cheap under load. Jobs are
+registered here just before they are enqueued (so a fast worker cannot release
+a job before it is registered) and released by the worker's task signals
+(celery_worker.py). If Redis cannot be reached the request is admitted.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+import redis
+import redis.asyncio as aioredis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_CACHE_SECONDS = float(os.getenv("ADMISSION_CACHE_SECONDS", "3"))
+# In-flight jobs are a sorted set scored by enqueue time. Jobs that were never released
+# (e.g. a worker was killed) stop counting after this long.
+IN_FLIGHT_TTL_SECONDS = 3600
+# After a Redis error, admit without checking for this many seconds.
+ADMISSION_REDIS_RETRY_SECONDS = 5
+
+# Thresholds per queue lane (Celery queue name). Override with ADMISSION_LANES, e.g.
+# '{"celery": {"max_queue_depth": 500, "max_user_in_flight": 20, "seconds_per_task": 30, "workers": 4}}'.
+DEFAULT_LANE = {"max_queue_depth": 500, "max_user_in_flight": 20, "seconds_per_task": 30, "workers": 4}
+ADMISSION_LANES: Dict[str, dict] = {
+    lane: {**DEFAULT_LANE, **limits}
+    for lane, limits in json.loads(os.getenv("ADMISSION_LANES", '{"celery": {}}')).items()
+}
+
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    def __init__(self, redis_url: str):
+        self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        self._aredis = aioredis.Redis.from_url(redis_url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        self._cached: Dict[str, Tuple[float, int]] = {}
+        self._lock = threading.Lock()
+        self._redis_down_until = 0.0
+
+    @staticmethod
+    def _in_flight_key(user_id: int) -> str:
+        return f"admission:jobs:{user_id}"
+
+    def _get_cached(self, key: str) -> Optional[int]:
+        with self._lock:
+            entry = self._cached.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def _set_cached(self, key: str, value: int):
+        with self._lock:
+            self._cached[key] = (time.monotonic() + ADMISSION_CACHE_SECONDS, value)
+
+    def _add_cached(self, key: str, delta: int):
+        with self._lock:
+            entry = self._cached.get(key)
+            if entry:
+                self._cached[key] = (entry[0], entry[1] + delta)
+
+    async def _in_flight(self, user_id: int) -> int:
+        value = self._get_cached(f"user:{user_id}")
+        if value is None:
+            pipe = self._aredis.pipeline(transaction=False)
+            pipe.zremrangebyscore(self._in_flight_key(user_id), 0, time.time() - IN_FLIGHT_TTL_SECONDS)
+            pipe.zcard(self._in_flight_key(user_id))
+            value = int((await pipe.execute())[1])
+            self._set_cached(f"user:{user_id}", value)
+        return value
+
+    async def _queue_depth(self, lane: str) -> int:
+        value = self._get_cached(f"queue:{lane}")
+        if value is None:
+            value = int(await self._aredis.llen(lane))
+            self._set_cached(f"queue:{lane}", value)
+        return value
+
+    @staticmethod
+    def estimated_wait(lane: str, queue_depth: int) -> int:
+        limits = ADMISSION_LANES[lane]
+        return int(queue_depth * limits["seconds_per_task"] / max(limits["workers"], 1)) + 1
+
+    async def check(self, lane: str, user_id: int, new_jobs: int, user_jobs: Optional[int] = None) -> int:
+        """
+        Raises Rejected (429 for the user's own backlog, 503 for a saturated queue).
+        Returns the estimated wait in seconds before the new jobs start.
+        `user_jobs` is what the new jobs count against the user's in-flight cap
+        (default: `new_jobs`); a batch such as a ZIP archive counts as one.
+        """
+        if not ADMISSION_ENABLED or lane not in ADMISSION_LANES or time.monotonic() < self._redis_down_until:
+            return 0
+        limits = ADMISSION_LANES[lane]
+        try:
+            in_flight = await self._in_flight(user_id)
+            queue_depth = await self._queue_depth(lane)
+        except Exception as e:
+            self._redis_down_until = time.monotonic() + ADMISSION_REDIS_RETRY_SECONDS
+            logger.warning(f"Admission check skipped, Redis unavailable: {e}")
+            return 0
+
+        wait = self.estimated_wait(lane, queue_depth)
+        if in_flight + (new_jobs if user_jobs is None else user_jobs) > limits["max_user_in_flight"]:
+            # The user's own jobs finish at about the lane's pace.
+            raise Rejected(429, self.estimated_wait(lane, in_flight), f"{in_flight} traitements déjà en cours (maximum {limits['max_user_in_flight']})")
+        if queue_depth + new_jobs > limits["max_queue_depth"]:
+            raise Rejected(503, wait, f"{queue_depth} documents en attente de traitement")
+        return wait
+
+    async def register(self, lane: str, user_id: int, task_ids):
+        """
+        Records jobs about to be enqueued (call it before .delay/.apply_async with the
+        same task ids) so they count against the user until the worker releases them.
+        """
+        if not ADMISSION_ENABLED or not task_ids or time.monotonic() < self._redis_down_until:
+            return
+        self._add_cached(f"user:{user_id}", len(task_ids))
+        self._add_cached(f"queue:{lane}", len(task_ids))
+        now = time.time()
+        try:
+            pipe = self._aredis.pipeline(transaction=False)
+            pipe.zadd(self._in_flight_key(user_id), {task_id: now for task_id in task_ids})
+            pipe.expire(self._in_flight_key(user_id), IN_FLIGHT_TTL_SECONDS)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Could not register in-flight jobs: {e}")
+
+    async def deregister(self, lane: str, user_id: int, task_ids):
+        """Undoes register() for jobs that could not be enqueued after all."""
+        if not ADMISSION_ENABLED or not task_ids:
+            return
+        self._add_cached(f"user:{user_id}", -len(task_ids))
+        self._add_cached(f"queue:{lane}", -len(task_ids))
+        try:
+            await self._aredis.zrem(self._in_flight_key(user_id), *task_ids)
+        except Exception as e:
+            logger.warning(f"Could not deregister in-flight jobs: {e}")
+
+    def release(self, user_id: Optional[int], task_id: str):
+        """Called from the worker when a job finishes, fails or is revoked."""
+        if user_id is None:
+            return
+        try:
+            self._redis.zrem(self._in_flight_key(user_id), task_id)
+        except Exception as e:
+            logger.warning(f"Could not release in-flight job {task_id}: {e}")
+
+
+_controller = AdmissionController(BROKER_URL)
+
+async def check(lane: str, user_id: int, new_jobs: int, user_jobs: Optional[int] = None) -> int:
+    return await _controller.check(lane, user_id, new_jobs, user_jobs)
+
+async def register(lane: str, user_id: int, task_ids):
+    await _controller.register(lane, user_id, task_ids)
+
+async def deregister(lane: str, user_id: int, task_ids):
+    await _controller.deregister(lane, user_id, task_ids)
+
+def release(user_id: Optional[int], task_id: str):
+    _controller.release(user_id, task_id)
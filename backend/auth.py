@@ -1,5 +1,8 @@
 
 # /auth.py
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 from fastapi import Depends, HTTPException, status
@@ -7,8 +10,9 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from sqlalchemy.orm import Session
-import crud, models, schemas
-from database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+import crud, models, schemas, cache
+from database import get_db, get_async_primary_db
 import os
 from dotenv import load_dotenv # You'll need to install this library
 
@@ -18,19 +22,60 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY", "a_default_fallback_key_if_not_set")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__ident="2b")
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+# Several tabs share one refresh token and may present it at the same time; a token
+# replayed within this window after its rotation is a race, not a theft.
+REFRESH_TOKEN_REUSE_GRACE_SECONDS = 30
+# Hashes with a different work factor are upgraded (or downgraded) on the next successful login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto", bcrypt__ident="2b",
+    bcrypt__default_rounds=BCRYPT_ROUNDS, bcrypt__min_desired_rounds=BCRYPT_ROUNDS, bcrypt__max_desired_rounds=BCRYPT_ROUNDS,
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# --- Password hashing executor ---
+# bcrypt is CPU-bound (~200 ms at 12 rounds) and releases the GIL, so it runs on a few
+# dedicated threads instead of the request threadpool. Beyond PASSWORD_HASH_MAX_PENDING
+# queued hashes the caller gets a 503 instead of waiting behind a login burst.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "1"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "16"))
+PASSWORD_HASH_RETRY_AFTER_SECONDS = 2
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_PENDING)
+
+def _submit_hash_job(fn, *args):
+    if not _hash_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Serveur surchargé, veuillez réessayer dans quelques instants.",
+            headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER_SECONDS)},
+        )
+    try:
+        future = _hash_executor.submit(fn, *args)
+    except Exception:
+        _hash_slots.release()
+        raise
+    future.add_done_callback(lambda _: _hash_slots.release())
+    return future
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return _submit_hash_job(pwd_context.hash, password).result()
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = crud.get_user_by_username(db, username=username)
-    if not user or not verify_password(password, user.hashed_password):
+def _verify_and_update(plain_password: str, hashed_password: str):
+    """Returns (valid, new hash or None); the new hash is set when the stored one uses other rounds."""
+    return _submit_hash_job(pwd_context.verify_and_update, plain_password, hashed_password)
+
+async def authenticate_user_async(db: AsyncSession, username: str, password: str):
+    user = await crud.get_user_by_username_async(db, username=username)
+    if not user:
+        return False
+    valid, new_hash = await asyncio.wrap_future(_verify_and_update(password, user.hashed_password))
+    if not valid:
         return False
+    if new_hash:
+        await crud.set_user_password_hash_async(db, user, new_hash)
     return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -39,27 +84,94 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def refresh_session(db: Session, refresh_token: str):
+    """
+    Exchanges a refresh token for (user, new refresh token) without any password check.
+    A token replayed within the grace window after its rotation only gets the user
+    back (new refresh token None): its successor already exists, and minting another
+    would let a replayed token keep a branch of the family alive. Replaying a token
+    after its grace window revokes every token of its family.
+    """
+    db_token = crud.get_refresh_token(db, refresh_token)
+    now = datetime.now(timezone.utc)
+    if db_token is None or db_token.revoked_at is not None or _as_utc(db_token.expires_at) < now:
+        raise _credentials_exception()
+    if db_token.rotated_at is not None and now - _as_utc(db_token.rotated_at) > timedelta(seconds=REFRESH_TOKEN_REUSE_GRACE_SECONDS):
+        crud.revoke_refresh_token_family(db, db_token.family_id)
+        raise _credentials_exception()
+
+    user = crud.get_user(db, db_token.user_id)
+    if user is None:
+        raise _credentials_exception()
+    if db_token.rotated_at is not None:
+        return user, None
+    return user, crud.rotate_refresh_token(db, db_token)
+
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Impossible de valider les informations d'identification",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def token_claims(user: models.User) -> dict:
+    # id and role let the API check a token against the cached user without a query.
+    return {"sub": user.user_name, "uid": user.id, "role": user.role}
+
+def _decode_token(token: str) -> schemas.TokenData:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
-        if username is None: raise credentials_exception
-        token_data = schemas.TokenData(username=username)
+        if username is None: raise _credentials_exception()
+        return schemas.TokenData(username=username, user_id=payload.get("uid"), role=payload.get("role"))
     except JWTError:
-        raise credentials_exception
-    user = crud.get_user_by_username(db, username=token_data.username)
-    if user is None: raise credentials_exception
+        raise _credentials_exception()
+
+def token_subject(token: str) -> Optional[str]:
+    """The token's subject if its signature is valid, else None (no DB access)."""
+    try:
+        return _decode_token(token).username
+    except HTTPException:
+        return None
+
+# --- Authenticated user cache ---
+# The caller is read through the shared cache (local LRU + Redis) under the USERS
+# version, which create/update/delete_user bump, so edits and deletions apply at once.
+
+def _authenticated_user(token_data: schemas.TokenData, cached: Optional[dict]) -> schemas.AuthenticatedUser:
+    if cached is None: raise _credentials_exception()
+    user = schemas.AuthenticatedUser(**cached)
+    # Tokens issued before a role change, or for a deleted user whose name was reused, are refused.
+    if token_data.user_id is not None and token_data.user_id != user.id: raise _credentials_exception()
+    if token_data.role is not None and token_data.role != user.role: raise _credentials_exception()
     return user
 
-def get_current_active_user(current_user: models.User = Depends(get_current_user)):
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    token_data = _decode_token(token)
+    def load():
+        user = crud.get_user_by_username(db, username=token_data.username)
+        return schemas.AuthenticatedUser.model_validate(user).model_dump() if user else None
+    cached = cache.get_or_load("auth-user", (cache.USERS,), {"sub": token_data.username}, load)
+    return _authenticated_user(token_data, cached)
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_primary_db)):
+    token_data = _decode_token(token)
+    async def load():
+        user = await crud.get_user_by_username_async(db, username=token_data.username)
+        return schemas.AuthenticatedUser.model_validate(user).model_dump() if user else None
+    cached = await cache.aget_or_load("auth-user", (cache.USERS,), {"sub": token_data.username}, load)
+    return _authenticated_user(token_data, cached)
+
+def get_current_active_user(current_user: schemas.AuthenticatedUser = Depends(get_current_user)):
+    return current_user
+
+async def get_current_active_user_async(current_user: schemas.AuthenticatedUser = Depends(get_current_user_async)):
     return current_user
 
-def require_admin(current_user: models.User = Depends(get_current_active_user)):
+def require_admin(current_user: schemas.AuthenticatedUser = Depends(get_current_active_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Privilèges d'administrateur requis.")
     return current_user
@@ -0,0 +1,102 @@
+# backend/bench/bulk_delete.py
+"""
+Benchmark for the chunked bulk delete (user-028).
+
+Seeds a throwaway SQLite database with N passports, each linked to a voyage,
+then times crud.delete_passports_by_ids on all of them and checks that no
+voyage_passport_association rows are left behind. With --naive it first tries
+the former single `DELETE ... WHERE id IN (...)` for comparison (rolled back).
+Whether that one fails depends on the SQLite build's bound-parameter limit
+(999 before 3.32, 32766 or more after); where it runs, it orphans every
+association row.
+
+    cd backend && python bench/bulk_delete.py --passports 50000 --naive
+
+This measures the crud layer; going through POST /passports/delete-multiple adds
+request parsing and auth on top.
+"""
+import os
+import sys
+import shutil
+import time
+import logging
+import argparse
+import tempfile
+from datetime import date
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(db, models, passport_count: int, voyage_count: int):
+    from sqlalchemy import insert, select
+    db.execute(insert(models.User), [{
+        "email": "bench@example.com", "user_name": "bench", "hashed_password": "-", "role": "admin",
+    }])
+    user_id = db.execute(select(models.User.id)).scalar_one()
+    db.execute(insert(models.Voyage), [{"destination": f"Destination {i}", "user_id": user_id} for i in range(voyage_count)])
+    voyage_ids = db.execute(select(models.Voyage.id)).scalars().all()
+    db.execute(insert(models.Passport), [{
+        "first_name": "Jean", "last_name": f"Bench{i}", "birth_date": date(1990, 1, 1),
+        "passport_number": f"P{i:08d}", "owner_id": user_id,
+    } for i in range(passport_count)])
+    passport_ids = db.execute(select(models.Passport.id)).scalars().all()
+    db.execute(insert(models.voyage_passport_association), [
+        {"voyage_id": voyage_ids[i % len(voyage_ids)], "passport_id": passport_id} for i, passport_id in enumerate(passport_ids)
+    ])
+    db.commit()
+    return user_id, passport_ids
+
+
+def count(db, table) -> int:
+    from sqlalchemy import select, func
+    return db.execute(select(func.count()).select_from(table)).scalar_one()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--passports", type=int, default=50_000)
+    parser.add_argument("--voyages", type=int, default=20)
+    parser.add_argument("--naive", action="store_true", help="also try the single IN (...) delete first")
+    args = parser.parse_args()
+
+    # database.py points at ./travel_app.db, so work from a scratch directory.
+    sys.path.insert(0, BACKEND_DIR)
+    scratch_dir = tempfile.mkdtemp(prefix="bench-bulk-delete-")
+    os.chdir(scratch_dir)
+    import models, crud
+    from database import SessionLocal, engine
+    # Every statement of a 50k-row run is "slow"; keep the output readable.
+    logging.getLogger("query_metrics").setLevel(logging.ERROR)
+    models.Base.metadata.create_all(bind=engine)
+
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        user_id, passport_ids = seed(db, models, args.passports, args.voyages)
+        print(f"seeded {len(passport_ids)} passports in {time.perf_counter() - started:.1f} s")
+
+        if args.naive:
+            started = time.perf_counter()
+            try:
+                deleted = db.query(models.Passport).filter(models.Passport.id.in_(passport_ids)).delete(synchronize_session=False)
+                elapsed = time.perf_counter() - started
+                orphans = count(db, models.voyage_passport_association)
+                db.rollback()
+                print(f"single IN (...) delete: {deleted} rows in {elapsed:.2f} s, {orphans} orphaned association rows (rolled back)")
+            except Exception as e:
+                db.rollback()
+                print(f"single IN (...) delete failed: {type(e).__name__}: {str(e).splitlines()[0]}")
+
+        started = time.perf_counter()
+        deleted = crud.delete_passports_by_ids(db, passport_ids=passport_ids, user_id=user_id, is_admin=True)
+        elapsed = time.perf_counter() - started
+        print(f"chunked delete (chunks of {crud.BULK_DELETE_CHUNK_SIZE}): {deleted} rows in {elapsed:.2f} s")
+        print(f"left: {count(db, models.Passport.__table__)} passports, {count(db, models.voyage_passport_association)} association rows")
+    finally:
+        db.close()
+        engine.dispose()
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
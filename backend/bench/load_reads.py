@@ -0,0 +1,86 @@
+# backend/bench/load_reads.py
+"""
+Load test for the read endpoints ported to AsyncSession (user-026).
+
+Fires concurrent authenticated GETs at a running API and reports throughput and
+latency percentiles per path. Run it against the same data once with the async
+routes and once with a build from before them (or against a sync route, e.g.
+/admin/filterable-users) to compare how far each gets past the threadpool size:
+
+    uvicorn main:app --workers 1            # or the gunicorn command from prestart.sh
+    python bench/load_reads.py --username admin --password ... --concurrency 200
+
+Disable the read-through cache (CACHE_ENABLED=false on the API) to measure the
+database path rather than cache hits.
+"""
+import time
+import argparse
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+DEFAULT_PATHS = ["/passports/", "/voyages/", "/destinations/", "/users/me"]
+
+
+def login(base_url: str, username: str, password: str) -> str:
+    response = requests.post(f"{base_url}/token", data={"username": username, "password": password}, timeout=30)
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def run_path(base_url: str, path: str, token: str, total: int, concurrency: int) -> dict:
+    local = threading.local()
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def one_request(_):
+        # One keep-alive session per client thread, as a browser would hold.
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            ok = local.session.get(f"{base_url}{path}", headers=headers, timeout=60).status_code == 200
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one_request, range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "path": path,
+        "requests": total,
+        "errors": sum(1 for _, ok in results if not ok),
+        "req_per_s": total / elapsed,
+        "p50_ms": quantiles[49] * 1000,
+        "p95_ms": quantiles[94] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--paths", default=",".join(DEFAULT_PATHS), help="comma-separated GET paths")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per path")
+    args = parser.parse_args()
+
+    token = login(args.base_url, args.username, args.password)
+    print(f"{'path':<28}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for path in args.paths.split(","):
+        # Short warm-up so connection setup and the first queries are not measured.
+        run_path(args.base_url, path, token, min(args.concurrency, 50), min(args.concurrency, 50))
+        stats = run_path(args.base_url, path, token, args.requests, args.concurrency)
+        print(f"{stats['path']:<28}{stats['req_per_s']:>9.1f}{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}{stats['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+# /cache.py
+"""
+Read-through cache for the hot GET endpoints.
+
+Two tiers: an in-process LRU (cachetools) in front of Redis. Every cached value
+is tied to the version counters of the entities it was built from; the crud
+write functions bump those counters, which changes the key of every dependent
+entry, so invalidation is exact without having to enumerate keys.
+
+Values must be loaded from the primary, not a read replica: the counters are bumped
+right after the primary commit, so a lagging replica's rows would otherwise be cached
+under the new version. The routes' ETag versions come from the same session.
+"""
+import os
+import json
+import hashlib
+import logging
+import time
+import threading
+from typing import Any, Awaitable, Callable, Dict, Sequence
+
+import redis
+import redis.asyncio as aioredis
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "60"))
+CACHE_LOCAL_MAXSIZE = int(os.getenv("CACHE_LOCAL_MAXSIZE", "1024"))
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+# After a Redis error, serve from the local tier only for this many seconds.
+CACHE_REDIS_RETRY_SECONDS = 5
+
+# Entities that have a version counter. Writes bump them through crud.
+USERS = "users"
+PASSPORTS = "passports"
+VOYAGES = "voyages"
+
+
+class ReadThroughCache:
+    def __init__(self, redis_url: str, ttl: int, local_maxsize: int):
+        self.ttl = ttl
+        self._local = TTLCache(maxsize=local_maxsize, ttl=ttl)
+        self._local_versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        self._aredis = aioredis.Redis.from_url(redis_url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        self._stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "errors": 0}
+        self._redis_down_until = 0.0
+        # Entities bumped while Redis was unreachable; their Redis counters are bumped on recovery.
+        self._pending_bumps: set = set()
+        self._outage = False
+
+    # --- Keys and versions ---
+
+    @staticmethod
+    def _version_key(entity: str) -> str:
+        return f"cache:version:{entity}"
+
+    def _entry_key(self, namespace: str, entities: Sequence[str], versions: Sequence[int], params: dict) -> str:
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+        version_part = ".".join(f"{entity}{version}" for entity, version in zip(entities, versions))
+        return f"cache:{namespace}:{version_part}:{digest}"
+
+    def _fallback_versions(self, entities: Sequence[str]):
+        return [self._local_versions.get(entity, 0) for entity in entities]
+
+    # TTLCache is not thread-safe and sync routes run in the threadpool.
+    def _local_get(self, key: str):
+        with self._lock:
+            return self._local.get(key)
+
+    def _local_set(self, key: str, value: Any):
+        with self._lock:
+            self._local[key] = value
+
+    def _record(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _redis_available(self) -> bool:
+        return time.monotonic() >= self._redis_down_until
+
+    def _redis_failed(self, e: Exception):
+        self._record("errors")
+        self._redis_down_until = time.monotonic() + CACHE_REDIS_RETRY_SECONDS
+        self._outage = True
+        logger.warning(f"Cache Redis tier unavailable, using local tier only: {e}")
+
+    # Writes made during an outage only bumped the local counters. On recovery their Redis
+    # counters are bumped as well, so no process keeps serving entries from the old
+    # version; the local tier is dropped since its keys were built from local counters.
+    def _start_recovery(self) -> set:
+        with self._lock:
+            pending, self._pending_bumps = self._pending_bumps, set()
+            self._outage = False
+        return pending
+
+    def _recovery_failed(self, pending: set, e: Exception):
+        with self._lock:
+            self._pending_bumps |= pending
+        self._redis_failed(e)
+
+    def _finish_recovery(self):
+        with self._lock:
+            self._local.clear()
+        logger.info("Cache Redis tier available again, local tier dropped.")
+
+    def _recover(self) -> bool:
+        pending = self._start_recovery()
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            for entity in pending:
+                pipe.incr(self._version_key(entity))
+            pipe.execute()
+        except Exception as e:
+            self._recovery_failed(pending, e)
+            return False
+        self._finish_recovery()
+        return True
+
+    async def _arecover(self) -> bool:
+        pending = self._start_recovery()
+        try:
+            pipe = self._aredis.pipeline(transaction=False)
+            for entity in pending:
+                pipe.incr(self._version_key(entity))
+            await pipe.execute()
+        except Exception as e:
+            self._recovery_failed(pending, e)
+            return False
+        self._finish_recovery()
+        return True
+
+    def bump(self, *entities: str):
+        """Invalidates every cached value built from any of `entities`."""
+        with self._lock:
+            for entity in entities:
+                self._local_versions[entity] = self._local_versions.get(entity, 0) + 1
+            if not self._redis_available():
+                self._pending_bumps.update(entities)
+                return
+        if self._outage and not self._recover():
+            with self._lock:
+                self._pending_bumps.update(entities)
+            return
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            for entity in entities:
+                pipe.incr(self._version_key(entity))
+            pipe.execute()
+        except Exception as e:
+            with self._lock:
+                self._pending_bumps.update(entities)
+            self._redis_failed(e)
+
+    # --- Sync API ---
+
+    def get_or_load(self, namespace: str, entities: Sequence[str], params: dict, loader: Callable[[], Any]) -> Any:
+        if not CACHE_ENABLED:
+            return loader()
+        redis_ok = self._redis_available()
+        if redis_ok and self._outage:
+            redis_ok = self._recover()
+        try:
+            if not redis_ok:
+                raise ConnectionError("Redis tier disabled")
+            raw_versions = self._redis.mget([self._version_key(e) for e in entities])
+            versions = [int(v or 0) for v in raw_versions]
+        except Exception as e:
+            if redis_ok:
+                self._redis_failed(e)
+            redis_ok = False
+            versions = self._fallback_versions(entities)
+
+        key = self._entry_key(namespace, entities, versions, params)
+        value = self._local_get(key)
+        if value is not None:
+            self._record("local_hits")
+            return value
+
+        if redis_ok:
+            try:
+                raw = self._redis.get(key)
+                if raw is not None:
+                    self._record("redis_hits")
+                    value = json.loads(raw)
+                    self._local_set(key, value)
+                    return value
+            except Exception as e:
+                self._redis_failed(e)
+                redis_ok = False
+
+        self._record("misses")
+        value = loader()
+        self._local_set(key, value)
+        if redis_ok:
+            try:
+                self._redis.set(key, json.dumps(value, default=str), ex=self.ttl)
+            except Exception as e:
+                self._redis_failed(e)
+        return value
+
+    # --- Async API (same logic, non-blocking Redis client) ---
+
+    async def aget_or_load(self, namespace: str, entities: Sequence[str], params: dict, loader: Callable[[], Awaitable[Any]]) -> Any:
+        if not CACHE_ENABLED:
+            return await loader()
+        redis_ok = self._redis_available()
+        if redis_ok and self._outage:
+            redis_ok = await self._arecover()
+        try:
+            if not redis_ok:
+                raise ConnectionError("Redis tier disabled")
+            raw_versions = await self._aredis.mget([self._version_key(e) for e in entities])
+            versions = [int(v or 0) for v in raw_versions]
+        except Exception as e:
+            if redis_ok:
+                self._redis_failed(e)
+            redis_ok = False
+            versions = self._fallback_versions(entities)
+
+        key = self._entry_key(namespace, entities, versions, params)
+        value = self._local_get(key)
+        if value is not None:
+            self._record("local_hits")
+            return value
+
+        if redis_ok:
+            try:
+                raw = await self._aredis.get(key)
+                if raw is not None:
+                    self._record("redis_hits")
+                    value = json.loads(raw)
+                    self._local_set(key, value)
+                    return value
+            except Exception as e:
+                self._redis_failed(e)
+                redis_ok = False
+
+        self._record("misses")
+        value = await loader()
+        self._local_set(key, value)
+        if redis_ok:
+            try:
+                await self._aredis.set(key, json.dumps(value, default=str), ex=self.ttl)
+            except Exception as e:
+                self._redis_failed(e)
+        return value
+
+    # --- Metrics ---
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["local_hits"] + stats["redis_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["local_hits"] + stats["redis_hits"]) / lookups, 4) if lookups else 0.0
+        with self._lock:
+            stats["local_entries"] = len(self._local)
+        return stats
+
+
+_cache = ReadThroughCache(CACHE_REDIS_URL, ttl=CACHE_TTL_SECONDS, local_maxsize=CACHE_LOCAL_MAXSIZE)
+
+def get_or_load(namespace: str, entities: Sequence[str], params: dict, loader: Callable[[], Any]) -> Any:
+    return _cache.get_or_load(namespace, entities, params, loader)
+
+async def aget_or_load(namespace: str, entities: Sequence[str], params: dict, loader: Callable[[], Awaitable[Any]]) -> Any:
+    return await _cache.aget_or_load(namespace, entities, params, loader)
+
+def bump(*entities: str):
+    _cache.bump(*entities)
+
+def stats() -> dict:
+    return _cache.stats()
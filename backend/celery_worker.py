@@ -143,21 +143,32 @@ import os
 from dotenv import load_dotenv
 load_dotenv()
 import time
-from typing import Optional
+from typing import List, Optional
 import tempfile
 import base64
 import ocr_service
 import crud
 import schemas
+import query_metrics
+import export_service
+import import_service
+import admission
+import database
 from database import SessionLocal
 from celery import Celery
 from celery.contrib.abortable import AbortableTask
-from celery.signals import task_revoked
+from celery.signals import task_revoked, task_prerun, task_postrun, worker_process_init, worker_process_shutdown
 from celery.utils.log import get_task_logger
 
 # --- Celery Configuration ---
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
+# Queue (admission lane) for OCR jobs; workers must consume it (-Q) if it is changed.
+OCR_QUEUE = os.getenv("OCR_QUEUE", "celery")
+# Photos take seconds, not minutes; give them their own queue and workers so they
+# don't wait behind PDF operations (add a matching ADMISSION_LANES entry).
+OCR_IMAGE_QUEUE = os.getenv("OCR_IMAGE_QUEUE", OCR_QUEUE)
+OCR_TASKS = ('tasks.extract_document_data', 'tasks.extract_image_data')
 
 celery_app = Celery(
     "tasks",
@@ -169,11 +180,44 @@ celery_app.conf.update(
     task_serializer='json',
     result_serializer='json',
     task_track_started=True,
+    task_routes={
+        'tasks.extract_document_data': {'queue': OCR_QUEUE},
+        'tasks.extract_image_data': {'queue': OCR_IMAGE_QUEUE},
+    },
 )
 
 logger = get_task_logger(__name__)
 
 
+# --- Per-process resources ---
+# The prefork pool forks its children from a parent that has imported the app. Pooled
+# DB connections and gRPC channels must not cross the fork, so each child starts its own
+# and keeps them for every task it runs. (With the solo/threads pools the same things
+# happen lazily on first use.)
+
+@worker_process_init.connect
+def on_worker_process_init(**kwargs):
+    # Forget connections inherited from the parent without closing them under its feet.
+    for db_engine in (database.engine, database.replica_engine):
+        if db_engine is not None:
+            db_engine.dispose(close=False)
+    try:
+        # Open the first connection now rather than in the first task.
+        with database.engine.connect():
+            pass
+    except Exception as e:
+        logger.warning(f"Could not open a database connection at worker start: {e}")
+
+    ocr_service.init_clients()
+
+@worker_process_shutdown.connect
+def on_worker_process_shutdown(**kwargs):
+    ocr_service.close_clients()
+    for db_engine in (database.engine, database.replica_engine):
+        if db_engine is not None:
+            db_engine.dispose()
+
+
 @task_revoked.connect
 def on_task_revoked(request, terminated, signum, expired, **kwargs):
     """
@@ -184,29 +228,52 @@ def on_task_revoked(request, terminated, signum, expired, **kwargs):
         f"Task {request.id} was revoked. "
         f"Terminated: {terminated}, Signal: {signum}, Expired: {expired}"
     )
+    if request.name in OCR_TASKS:
+        admission.release((request.kwargs or {}).get('user_id'), request.id)
+
+
+_query_metric_tokens = {}
+
+@task_prerun.connect
+def on_task_prerun(task_id, task, **kwargs):
+    """Starts per-task SQL stats (same hooks as the API's request middleware)."""
+    _query_metric_tokens[task_id] = query_metrics.start(f"task {task.name}")
+
+@task_postrun.connect
+def on_task_postrun(task_id, task, state=None, **kwargs):
+    if task.name in OCR_TASKS:
+        admission.release((kwargs.get('kwargs') or {}).get('user_id'), task_id)
+    token = _query_metric_tokens.pop(task_id, None)
+    if token is None:
+        return
+    stats = query_metrics.finish(token)
+    logger.info(f"Task {task_id} ({task.name}, {state}) DB: {stats.count} queries, {stats.total_ms:.1f} ms")
 
 
 # FIX: Use AbortableTask as base class to enable revocation checking
 @celery_app.task(bind=True, base=AbortableTask, name='tasks.extract_document_data')
-def extract_document_data(self, file_content: bytes, original_filename: str, content_type: str, destination: Optional[str], user_id: int):
+def extract_document_data(self, file_content: Optional[str], original_filename: str, content_type: str, destination: Optional[str], user_id: int, spooled_path: Optional[str] = None):
     """
     Celery task to perform OCR, parse results, and save them to the database.
     
     Uses AbortableTask to properly support cancellation via is_aborted().
+    The document comes either base64-encoded in `file_content` or, for resumable
+    uploads, as a file in the shared upload spool (`spooled_path`), which the task then owns.
     """
     gcs_source_uri = None
     google_operation_name = None
-    file_path = None
+    file_path = spooled_path
     was_cancelled = False
 
     try:
-        # Decode the Base64 string back into bytes
-        file_content = base64.b64decode(file_content)
+        if file_path is None:
+            # Decode the Base64 string back into bytes
+            file_content = base64.b64decode(file_content)
 
-        # Create a temporary file inside the worker container to store the content
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f"-{original_filename}") as temp_file:
-            temp_file.write(file_content)
-            file_path = temp_file.name
+            # Create a temporary file inside the worker container to store the content
+            with tempfile.NamedTemporaryFile(delete=False, suffix=f"-{original_filename}") as temp_file:
+                temp_file.write(file_content)
+                file_path = temp_file.name
 
         # FIX: Check for early cancellation using is_aborted()
         if self.is_aborted():
@@ -279,6 +346,7 @@ def extract_document_data(self, file_content: bytes, original_filename: str, con
 
     except Exception as e:
         logger.error(f"Error in Celery task {self.request.id}: {e}", exc_info=True)
+        ocr_service.reset_clients_after(e)
         # Don't re-raise if task was cancelled
         if was_cancelled or self.is_aborted():
             return {'status': 'CANCELLED', 'detail': 'Task was cancelled during error handling.'}
@@ -308,3 +376,125 @@ def extract_document_data(self, file_content: bytes, original_filename: str, con
                 logger.info(f"Cleaned up temporary file: {file_path}")
             except Exception as cleanup_error:
                 logger.error(f"Failed to delete temp file {file_path}: {cleanup_error}")
+
+
+@celery_app.task(bind=True, base=AbortableTask, name='tasks.extract_image_data')
+def extract_image_data(self, images: List[dict], destination: Optional[str], user_id: int):
+    """
+    Celery task for photographed passports: each image ({filename, content_type} plus
+    base64 `file_content` or a spooled `spooled_path`) is downscaled, the batch is sent
+    through Vision's synchronous image annotation, and the results are saved.
+    """
+    filenames = [image['filename'] for image in images]
+    failures = []
+    prepared = []
+    try:
+        if self.is_aborted():
+            return {'status': 'CANCELLED', 'detail': 'Task was cancelled by user.'}
+
+        self.update_state(state='PROGRESS', meta={'status': 'Preparing images...'})
+        for image in images:
+            try:
+                if image.get('spooled_path'):
+                    prepared.append((image['filename'], ocr_service.prepare_image(image['spooled_path'])))
+                else:
+                    with tempfile.NamedTemporaryFile(suffix=f"-{image['filename']}") as temp_file:
+                        temp_file.write(base64.b64decode(image['file_content']))
+                        temp_file.flush()
+                        prepared.append((image['filename'], ocr_service.prepare_image(temp_file.name)))
+            except Exception as e:
+                logger.warning(f"Could not read image {image['filename']}: {e}")
+                failures.append({"page": image['filename'], "error": f"Image illisible: {e}"})
+
+        if self.is_aborted():
+            return {'status': 'CANCELLED', 'detail': 'Task was cancelled by user.'}
+
+        self.update_state(state='PROGRESS', meta={'status': 'Processing document...'})
+        results = ocr_service.annotate_images([content for _, content in prepared]) if prepared else []
+
+        self.update_state(state='PROGRESS', meta={'status': 'Saving results to database...'})
+        db = SessionLocal()
+        success_count = 0
+        try:
+            for (filename, _), page_result in zip(prepared, results):
+                if page_result.get('status') == 'SUCCESS':
+                    passport_data = schemas.PassportCreate(**page_result['data'], destination=destination)
+                    crud.create_user_passport(db=db, passport=passport_data, user_id=user_id)
+                    success_count += 1
+                else:
+                    failures.append({"page": filename, "error": page_result.get('error', 'Unknown parsing error')})
+        finally:
+            db.close()
+
+        return {
+            'status': 'COMPLETE',
+            'filename': ", ".join(filenames),
+            'successful_pages': success_count,
+            'failed_pages': failures
+        }
+    except Exception as e:
+        logger.error(f"Error in Celery task {self.request.id}: {e}", exc_info=True)
+        ocr_service.reset_clients_after(e)
+        if self.is_aborted():
+            return {'status': 'CANCELLED', 'detail': 'Task was cancelled during error handling.'}
+        raise e
+    finally:
+        for image in images:
+            if image.get('spooled_path') and os.path.exists(image['spooled_path']):
+                try:
+                    os.remove(image['spooled_path'])
+                except Exception as cleanup_error:
+                    logger.error(f"Failed to delete spooled image {image['spooled_path']}: {cleanup_error}")
+
+
+# Report export progress every this many rows.
+EXPORT_PROGRESS_EVERY = 10_000
+
+@celery_app.task(bind=True, name='tasks.export_data')
+def export_data_job(self, destination: Optional[str], user_id: Optional[int], first_name: Optional[str], last_name: Optional[str], export_format: str, owner_id: int, filename: str):
+    """
+    Celery task that writes a full export to the shared spool (EXPORT_DIR),
+    so very large exports don't hold an API connection open.
+    """
+    export_service.purge_expired_exports()
+    path = export_service.export_path(self.request.id, export_format)
+    rows_written = 0
+
+    def counted(rows):
+        nonlocal rows_written
+        for row in rows:
+            rows_written += 1
+            if rows_written % EXPORT_PROGRESS_EVERY == 0:
+                self.update_state(state='PROGRESS', meta={'status': 'Exporting...', 'rows': rows_written, 'owner_id': owner_id})
+            yield row
+
+    self.update_state(state='PROGRESS', meta={'status': 'Exporting...', 'rows': 0, 'owner_id': owner_id})
+    rows = export_service.iter_export_rows(destination, user_id, first_name, last_name)
+    export_service.write_export(path, export_format, counted(rows))
+    logger.info(f"Export {self.request.id} wrote {rows_written} rows to {path}")
+
+    return {
+        'status': 'COMPLETE',
+        'owner_id': owner_id,
+        'format': export_format,
+        'filename': filename,
+        'rows': rows_written,
+        'path': path,
+    }
+
+
+@celery_app.task(bind=True, name='tasks.import_passports')
+def import_passports_job(self, path: str, import_format: str, user_id: int, filename: str):
+    """Celery task that imports a spooled CSV / NDJSON upload (see POST /passports/import)."""
+    def report(progress):
+        self.update_state(state='PROGRESS', meta={'status': 'Importing...', 'rows': progress['rows']})
+
+    try:
+        self.update_state(state='PROGRESS', meta={'status': 'Importing...', 'rows': 0})
+        with open(path, "rb") as f:
+            result = import_service.import_passports(f, import_format, user_id, on_progress=report)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    logger.info(f"Import {self.request.id} ({filename}): {result['created']} created, {result['updated']} updated, {result['failed']} failed")
+    return {'status': 'COMPLETE', 'filename': filename, **result}
@@ -2,11 +2,14 @@
 
 # /crud.py
 
-from sqlalchemy.orm import Session, joinedload, outerjoin
-import models, schemas, auth
+from sqlalchemy import select, insert, update, delete, func, literal, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, outerjoin, selectinload
+import models, schemas, auth, cache
 import secrets
+import hashlib
 from datetime import datetime, timedelta, timezone
-from typing import Optional, List
+from typing import Optional, List, Callable
 from fastapi import HTTPException
 from http import HTTPStatus
 
@@ -52,6 +55,7 @@ def create_user(db: Session, user: schemas.UserCreate, token: Optional[str] = No
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    cache.bump(cache.USERS)
     return db_user
 
 def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate):
@@ -61,44 +65,64 @@ def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate):
     if "password" in update_data and update_data["password"]:
         hashed_password = auth.get_password_hash(update_data["password"])
         db_user.hashed_password = hashed_password
+        # A new password signs the user out everywhere.
+        _revoke_user_refresh_tokens(db, user_id)
     update_data.pop("password", None)
     for key, value in update_data.items():
         setattr(db_user, key, value)
     db.commit()
     db.refresh(db_user)
+    cache.bump(cache.USERS)
     return db_user
 
+async def set_user_password_hash_async(db: AsyncSession, db_user: models.User, hashed_password: str):
+    # Rehash on login: same password, new work factor, so cached users stay valid.
+    db_user.hashed_password = hashed_password
+    await db.commit()
+
 def delete_user(db: Session, user_id: int):
     db_user = get_user(db, user_id)
     if db_user:
         db.delete(db_user)
         db.commit()
+        cache.bump(cache.USERS, cache.PASSPORTS, cache.VOYAGES)
     return db_user
 
 def get_passport(db: Session, passport_id: int):
     return db.query(models.Passport).filter(models.Passport.id == passport_id).first()
 
-def get_passports(db: Session, skip: int = 0, limit: int = 100, user_filter: Optional[str] = None, voyage_filter: Optional[str] = None):
-    query = db.query(models.Passport)
-    if user_filter:
-        if user_filter.isdigit():
-            query = query.filter(models.Passport.owner_id == int(user_filter))
-        else:
-            query = query.join(models.User).filter(
-                models.User.first_name.ilike(f"%{user_filter}%") |
-                models.User.last_name.ilike(f"%{user_filter}%") |
-                models.User.user_name.ilike(f"%{user_filter}%")
-            )
-    if voyage_filter:
-        query = query.join(models.Passport.voyages)
-        if voyage_filter.isdigit():
-            query = query.filter(models.Voyage.id == int(voyage_filter))
-        else:
-            query = query.filter(models.Voyage.destination.ilike(f"%{voyage_filter}%"))
-    return query.offset(skip).limit(limit).all()
+def _bump_owner_versions(db: Session, *owner_ids: int):
+    """Increments the per-owner change counter (User.data_version) in the current transaction."""
+    owner_ids = {owner_id for owner_id in owner_ids if owner_id is not None}
+    if owner_ids:
+        db.query(models.User).filter(models.User.id.in_(owner_ids)).update(
+            {models.User.data_version: models.User.data_version + 1}, synchronize_session=False
+        )
 
-def get_passports_by_user(db: Session, user_id: int):
-    return db.query(models.Passport).filter(models.Passport.owner_id == user_id).all()
+def _touch_passports(db: Session, passport_ids):
+    """Marks passports as changed for delta sync when only their voyage associations changed."""
+    now = datetime.now(timezone.utc)
+    for chunk in _chunked(sorted(set(passport_ids)), BULK_DELETE_CHUNK_SIZE):
+        db.query(models.Passport).filter(models.Passport.id.in_(chunk)).update(
+            {models.Passport.updated_at: now}, synchronize_session=False
+        )
+
+# Tombstones older than this are pruned; clients with an older cursor must do a full resync.
+TOMBSTONE_RETENTION_DAYS = 30
+
+def _record_tombstones(db: Session, passports):
+    """Inserts a tombstone per (passport_id, owner_id) and prunes expired ones for those owners."""
+    if not passports:
+        return
+    now = datetime.now(timezone.utc)
+    db.execute(models.PassportTombstone.__table__.insert(), [
+        {"passport_id": passport_id, "owner_id": owner_id, "deleted_at": now} for passport_id, owner_id in passports
+    ])
+    cutoff = now - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+    db.query(models.PassportTombstone).filter(
+        models.PassportTombstone.owner_id.in_({owner_id for _, owner_id in passports}),
+        models.PassportTombstone.deleted_at < cutoff
+    ).delete(synchronize_session=False)
 
 def create_user_passport(db: Session, passport: schemas.PassportCreate, user_id: int):
     # First, check if a passport with this number already exists for the current user.
@@ -106,6 +130,7 @@ def create_user_passport(db: Session, passport: schemas.PassportCreate, user_id:
         models.Passport.passport_number == passport.passport_number,
         models.Passport.owner_id == user_id
     ).first()
+    changed = False
 
     # If the passport does not exist, create a new one.
     if not db_passport:
@@ -116,8 +141,7 @@ def create_user_passport(db: Session, passport: schemas.PassportCreate, user_id:
             confidence_score=passport.confidence_score
         )
         db.add(db_passport)
-        db.commit()
-        db.refresh(db_passport)
+        changed = True
 
     # Now, handle the destination/voyage association.
     if passport.destination:
@@ -131,16 +155,20 @@ def create_user_passport(db: Session, passport: schemas.PassportCreate, user_id:
         if not db_voyage:
             db_voyage = models.Voyage(destination=passport.destination, user_id=user_id)
             db.add(db_voyage)
-            # We commit here to give the voyage an ID before associating it
-            db.commit()
-            db.refresh(db_voyage)
-
-        # Check if the passport is already associated with this voyage.
-        if db_passport not in db_voyage.passports:
-            db_voyage.passports.append(db_passport)
-            db.commit()
-            db.refresh(db_passport)
-    
+
+        # Check if the passport is already associated with this voyage
+        # (from the passport side, which holds far fewer rows than the voyage).
+        if db_voyage not in db_passport.voyages:
+            db_passport.voyages.append(db_voyage)
+            changed = True
+
+    if changed:
+        # Passport, voyage and association are written in a single transaction.
+        db_passport.updated_at = datetime.now(timezone.utc)
+        _bump_owner_versions(db, user_id)
+        db.commit()
+        db.refresh(db_passport)
+        cache.bump(cache.PASSPORTS, cache.VOYAGES)
     return db_passport
 
 def update_passport(db: Session, passport_id: int, passport_update: schemas.PassportCreate):
@@ -177,51 +205,243 @@ def update_passport(db: Session, passport_id: int, passport_update: schemas.Pass
             db.add(db_voyage)
         db_passport.voyages.append(db_voyage)
 
+    db_passport.updated_at = datetime.now(timezone.utc)
+    _bump_owner_versions(db, db_passport.owner_id)
     db.commit()
     db.refresh(db_passport)
+    cache.bump(cache.PASSPORTS, cache.VOYAGES)
     return db_passport
 
 def delete_passport(db: Session, passport_id: int):
     db_passport = get_passport(db, passport_id)
     if db_passport:
         db.delete(db_passport)
+        _record_tombstones(db, [(db_passport.id, db_passport.owner_id)])
+        _bump_owner_versions(db, db_passport.owner_id)
         db.commit()
+    cache.bump(cache.PASSPORTS)
     return db_passport
 
+# Keeps every IN (...) well under SQLite's bound-parameter limit (999 on older builds).
+BULK_DELETE_CHUNK_SIZE = 500
+
+def _chunked(ids: List[int], size: int):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+def _bulk_delete(db: Session, model, ids: List[int], owner_column, association_column, user_id: int, is_admin: bool,
+                 before_delete: Optional[Callable[[Session, list], None]] = None) -> int:
+    """
+    Deletes rows of `model` by id in chunks, removing their voyage_passport_association
+    rows in the same transaction. Non-admins only delete rows they own.
+    `before_delete` receives each chunk's (id, owner_id) rows before anything is removed.
+    Returns the number of deleted rows.
+    """
+    num_deleted = 0
+    for chunk in _chunked(sorted(set(ids)), BULK_DELETE_CHUNK_SIZE):
+        query = db.query(model.id, owner_column).filter(model.id.in_(chunk))
+        if not is_admin:
+            query = query.filter(owner_column == user_id)
+        rows = query.all()
+        if not rows:
+            continue
+        allowed_ids = [row[0] for row in rows]
+        if before_delete:
+            before_delete(db, rows)
+        _bump_owner_versions(db, *{row[1] for row in rows})
+        db.execute(delete(models.voyage_passport_association).where(association_column.in_(allowed_ids)))
+        num_deleted += db.query(model).filter(model.id.in_(allowed_ids)).delete(synchronize_session=False)
+    db.commit()
+    cache.bump(cache.PASSPORTS, cache.VOYAGES)
+    return num_deleted
+
 def delete_passports_by_ids(db: Session, *, passport_ids: List[int], user_id: int, is_admin: bool):
     """
     Deletes multiple passports from the database based on a list of IDs.
     - If the user is not an admin, it will only delete passports that belong to them.
     """
-    query = db.query(models.Passport).filter(models.Passport.id.in_(passport_ids))
-    
-    # Security check: Non-admins can only delete their own passports.
-    if not is_admin:
-        # Correctly checks against the 'owner_id' column
-        query = query.filter(models.Passport.owner_id == user_id)
-        
-    num_deleted = query.delete(synchronize_session=False)
-    db.commit()
-    return num_deleted
+    return _bulk_delete(
+        db, models.Passport, passport_ids,
+        owner_column=models.Passport.owner_id,
+        association_column=models.voyage_passport_association.c.passport_id,
+        user_id=user_id, is_admin=is_admin,
+        before_delete=_record_tombstones
+    )
 
-def get_voyage(db: Session, voyage_id: int):
-    return db.query(models.Voyage).filter(models.Voyage.id == voyage_id).first()
+# Fields an import row may set on a passport (destination is handled through voyages).
+IMPORT_PASSPORT_FIELDS = (
+    "first_name", "last_name", "birth_date", "expiration_date", "delivery_date",
+    "nationality", "passport_number", "confidence_score",
+)
+
+def _get_or_create_voyages(db: Session, user_id: int, destinations) -> dict:
+    """Returns {destination: voyage_id} for the user, inserting the missing voyages in bulk."""
+    def lookup():
+        voyage_ids = {}
+        for destination, voyage_id in db.query(models.Voyage.destination, models.Voyage.id).filter(
+            models.Voyage.user_id == user_id, models.Voyage.destination.in_(destinations)
+        ).order_by(models.Voyage.id):
+            voyage_ids.setdefault(destination, voyage_id)
+        return voyage_ids
+
+    voyage_ids = lookup()
+    missing = [destination for destination in destinations if destination not in voyage_ids]
+    if missing:
+        now = datetime.now(timezone.utc)
+        db.execute(insert(models.Voyage), [{"destination": destination, "user_id": user_id, "updated_at": now} for destination in missing])
+        voyage_ids = lookup()
+    return voyage_ids
+
+def bulk_upsert_passports(db: Session, passports: List[schemas.PassportCreate], user_id: int) -> dict:
+    """
+    Imports one chunk of validated passports in a single transaction.
+    Passports are matched on (owner, passport_number) like create_user_passport, but
+    existing ones are updated from the import. Voyages are fetched or created in bulk.
+    Returns {"created": n, "updated": n}.
+    """
+    association = models.voyage_passport_association
+    now = datetime.now(timezone.utc)
+
+    # The last row wins for a number repeated in the chunk; destinations accumulate.
+    by_number = {}
+    destinations = {}
+    for passport in passports:
+        by_number[passport.passport_number] = passport
+        if passport.destination:
+            destinations.setdefault(passport.passport_number, set()).add(passport.destination)
+
+    def lookup():
+        passport_ids = {}
+        for passport_number, passport_id in db.query(models.Passport.passport_number, models.Passport.id).filter(
+            models.Passport.owner_id == user_id, models.Passport.passport_number.in_(by_number)
+        ).order_by(models.Passport.id):
+            passport_ids.setdefault(passport_number, passport_id)
+        return passport_ids
+
+    passport_ids = lookup()
+
+    def values(passport):
+        return {**passport.model_dump(include=set(IMPORT_PASSPORT_FIELDS)), "updated_at": now}
+
+    updates = [{"id": passport_ids[number], **values(p)} for number, p in by_number.items() if number in passport_ids]
+    if updates:
+        db.execute(update(models.Passport), updates)
+    new_rows = [{**values(p), "owner_id": user_id} for number, p in by_number.items() if number not in passport_ids]
+    if new_rows:
+        # A plain executemany and a second lookup beat INSERT ... RETURNING, which
+        # SQLite can only do row by row when the order of the ids matters.
+        db.execute(insert(models.Passport), new_rows)
+        if destinations:
+            passport_ids = lookup()
+
+    if destinations:
+        voyage_ids = _get_or_create_voyages(db, user_id, sorted(set().union(*destinations.values())))
+        wanted = {
+            (voyage_ids[destination], passport_ids[number])
+            for number, numbers_destinations in destinations.items() for destination in numbers_destinations
+        }
+        existing = set(db.query(association.c.voyage_id, association.c.passport_id).filter(
+            association.c.passport_id.in_({passport_id for _, passport_id in wanted})
+        ).all())
+        missing = wanted - existing
+        if missing:
+            db.execute(association.insert(), [{"voyage_id": v, "passport_id": p} for v, p in sorted(missing)])
+
+    _bump_owner_versions(db, user_id)
+    db.commit()
+    cache.bump(cache.PASSPORTS, cache.VOYAGES)
+    return {"created": len(new_rows), "updated": len(updates)}
 
-def get_voyages(db: Session, skip: int = 0, limit: int = 100, user_filter: Optional[str] = None):
-    query = db.query(models.Voyage)
-    if user_filter:
-        if user_filter.isdigit():
-            query = query.filter(models.Voyage.user_id == int(user_filter))
-        else:
-            query = query.join(models.User).filter(
-                models.User.first_name.ilike(f"%{user_filter}%") |
-                models.User.last_name.ilike(f"%{user_filter}%") |
-                models.User.user_name.ilike(f"%{user_filter}%")
+def _check_destination_conflicts(db: Session, passports, destinations: List[str]):
+    """
+    Applies update_passport's rule to a batch: a passport number can only be
+    registered once per owner and destination.
+    """
+    keys = set()
+    for _, owner_id, passport_number in passports:
+        if (owner_id, passport_number) in keys:
+            raise HTTPException(
+                status_code=HTTPStatus.CONFLICT,
+                detail=f"Le passeport numéro '{passport_number}' est déjà enregistré pour la destination '{destinations[0]}'.",
             )
-    return query.offset(skip).limit(limit).all()
+        keys.add((owner_id, passport_number))
+    # Rows of the batch itself are excluded here rather than in SQL: a NOT IN over the
+    # whole batch would exceed the bound-parameter limit on large batches.
+    batch_ids = {passport_id for passport_id, _, _ in passports}
+    for chunk in _chunked(sorted(keys), BULK_DELETE_CHUNK_SIZE):
+        rows = db.query(models.Passport.id, models.Passport.passport_number, models.Voyage.destination).join(models.Passport.voyages).filter(
+            tuple_(models.Passport.owner_id, models.Passport.passport_number).in_(chunk),
+            models.Voyage.destination.in_(destinations)
+        )
+        for passport_id, passport_number, destination in rows:
+            if passport_id not in batch_ids:
+                raise HTTPException(
+                    status_code=HTTPStatus.CONFLICT,
+                    detail=f"Le passeport numéro '{passport_number}' est déjà enregistré pour la destination '{destination}'.",
+                )
+
+def batch_update_passports(db: Session, *, batch: schemas.PassportBatchUpdate, user_id: int, is_admin: bool) -> dict:
+    """
+    Applies field updates and voyage add/remove operations to many passports with
+    set-based statements, in a single transaction.
+    - If the user is not an admin, passports of other users are skipped.
+    Returns {"updated": n, "skipped": [ids]}.
+    """
+    association = models.voyage_passport_association
+    requested_ids = sorted(set(batch.ids))
+    fields = batch.fields.model_dump(exclude_none=True) if batch.fields else {}
+
+    passports = []
+    for chunk in _chunked(requested_ids, BULK_DELETE_CHUNK_SIZE):
+        query = db.query(models.Passport.id, models.Passport.owner_id, models.Passport.passport_number).filter(models.Passport.id.in_(chunk))
+        if not is_admin:
+            query = query.filter(models.Passport.owner_id == user_id)
+        passports.extend(query.all())
+    passport_ids = [passport_id for passport_id, _, _ in passports]
+    skipped = sorted(set(requested_ids) - set(passport_ids))
+    if not passports:
+        return {"updated": 0, "skipped": skipped}
+
+    add_destinations = sorted(set(batch.add_destinations))
+    remove_destinations = sorted(set(batch.remove_destinations) - set(add_destinations))
+    if add_destinations:
+        _check_destination_conflicts(db, passports, add_destinations)
+
+    now = datetime.now(timezone.utc)
+    for chunk in _chunked(passport_ids, BULK_DELETE_CHUNK_SIZE):
+        db.query(models.Passport).filter(models.Passport.id.in_(chunk)).update(
+            {**fields, "updated_at": now}, synchronize_session=False
+        )
+        if remove_destinations:
+            db.execute(delete(association).where(
+                association.c.passport_id.in_(chunk),
+                association.c.voyage_id.in_(select(models.Voyage.id).where(models.Voyage.destination.in_(remove_destinations)))
+            ))
+
+    if add_destinations:
+        ids_by_owner = {}
+        for passport_id, owner_id, _ in passports:
+            ids_by_owner.setdefault(owner_id, []).append(passport_id)
+        for owner_id, owner_passport_ids in ids_by_owner.items():
+            voyage_ids = list(_get_or_create_voyages(db, owner_id, add_destinations).values())
+            for chunk in _chunked(owner_passport_ids, BULK_DELETE_CHUNK_SIZE):
+                existing = set(db.query(association.c.voyage_id, association.c.passport_id).filter(
+                    association.c.passport_id.in_(chunk), association.c.voyage_id.in_(voyage_ids)
+                ).all())
+                missing = [
+                    {"voyage_id": voyage_id, "passport_id": passport_id}
+                    for passport_id in chunk for voyage_id in voyage_ids if (voyage_id, passport_id) not in existing
+                ]
+                if missing:
+                    db.execute(association.insert(), missing)
+
+    _bump_owner_versions(db, *{owner_id for _, owner_id, _ in passports})
+    db.commit()
+    cache.bump(cache.PASSPORTS, cache.VOYAGES)
+    return {"updated": len(passports), "skipped": skipped}
 
-def get_voyages_by_user(db: Session, user_id: int):
-    return db.query(models.Voyage).filter(models.Voyage.user_id == user_id).all()
+def get_voyage(db: Session, voyage_id: int):
+    return db.query(models.Voyage).filter(models.Voyage.id == voyage_id).first()
 
 def create_user_voyage(db: Session, voyage: schemas.VoyageCreate, user_id: int, passport_ids: list[int]):
     db_voyage = models.Voyage(destination=voyage.destination, user_id=user_id)
@@ -229,71 +449,192 @@ def create_user_voyage(db: Session, voyage: schemas.VoyageCreate, user_id: int,
         passports = db.query(models.Passport).filter(models.Passport.id.in_(passport_ids)).all()
         db_voyage.passports.extend(passports)
     db.add(db_voyage)
+    _touch_passports(db, [p.id for p in db_voyage.passports])
+    _bump_owner_versions(db, user_id, *(p.owner_id for p in db_voyage.passports))
     db.commit()
     db.refresh(db_voyage)
+    cache.bump(cache.VOYAGES, cache.PASSPORTS)
     return db_voyage
 
 def update_voyage(db: Session, voyage_id: int, voyage_update: schemas.VoyageCreate):
     db_voyage = get_voyage(db, voyage_id)
     if not db_voyage: return None
     db_voyage.destination = voyage_update.destination
+    affected_owners = {db_voyage.user_id, *(p.owner_id for p in db_voyage.passports)}
+    affected_passports = {p.id for p in db_voyage.passports}
     if voyage_update.passport_ids is not None:
         passports = db.query(models.Passport).filter(models.Passport.id.in_(voyage_update.passport_ids)).all()
         db_voyage.passports = passports
+        affected_owners.update(p.owner_id for p in passports)
+        affected_passports.update(p.id for p in passports)
+    _touch_passports(db, affected_passports)
+    _bump_owner_versions(db, *affected_owners)
     db.commit()
     db.refresh(db_voyage)
+    cache.bump(cache.VOYAGES, cache.PASSPORTS)
     return db_voyage
 
 def delete_voyage(db: Session, voyage_id: int):
     db_voyage = get_voyage(db, voyage_id)
     if db_voyage:
+        _touch_passports(db, [p.id for p in db_voyage.passports])
+        _bump_owner_versions(db, db_voyage.user_id, *(p.owner_id for p in db_voyage.passports))
         db.delete(db_voyage)
         db.commit()
+        cache.bump(cache.VOYAGES, cache.PASSPORTS)
     return db_voyage
 
-def filter_data(db: Session, destination: Optional[str], user_id: Optional[int], first_name: Optional[str], last_name: Optional[str]):
-    query = db.query(models.Passport)
+def _touch_voyage_passports(db: Session, voyages):
+    """Marks the passports linked to the voyages as changed and bumps their owners' data_version."""
+    association = models.voyage_passport_association
+    voyage_ids = [voyage_id for voyage_id, _ in voyages]
+    rows = db.query(models.Passport.id, models.Passport.owner_id).join(
+        association, association.c.passport_id == models.Passport.id
+    ).filter(association.c.voyage_id.in_(voyage_ids)).all()
+    _touch_passports(db, [passport_id for passport_id, _ in rows])
+    _bump_owner_versions(db, *{owner_id for _, owner_id in rows})
+
+def delete_voyages_by_ids(db: Session, *, voyage_ids: List[int], user_id: int, is_admin: bool):
+    """
+    Deletes multiple voyages from the database based on a list of IDs.
+    - If the user is not an admin, it will only delete voyages that belong to them.
+    """
+    return _bulk_delete(
+        db, models.Voyage, voyage_ids,
+        owner_column=models.Voyage.user_id,
+        association_column=models.voyage_passport_association.c.voyage_id,
+        user_id=user_id, is_admin=is_admin,
+        before_delete=_touch_voyage_passports
+    )
 
-    if user_id is not None:
-        query = query.filter(models.Passport.owner_id == user_id)
+# Column order of every export format.
+EXPORT_COLUMNS = (
+    "id", "first_name", "last_name", "birth_date", "delivery_date", "expiration_date",
+    "nationality", "passport_number", "owner_id", "destination",
+)
+EXPORT_BATCH_SIZE = 1000
 
-    if destination:
-        query = query.join(models.Passport.voyages).filter(models.Voyage.destination.ilike(f"%{destination}%"))
+def _destinations_subquery(db: Session, passport_conditions: list):
+    """
+    One row per matching passport with its distinct destinations, sorted and joined
+    with ", " in SQL: string_agg on Postgres, group_concat over an ordered subquery on SQLite.
+    """
+    association = models.voyage_passport_association
+    pairs = select(association.c.passport_id, models.Voyage.destination).join(
+        models.Voyage, models.Voyage.id == association.c.voyage_id
+    ).distinct()
+    if passport_conditions:
+        # Only aggregate the passports being exported.
+        pairs = pairs.where(association.c.passport_id.in_(select(models.Passport.id).where(*passport_conditions)))
+
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import aggregate_order_by
+        pairs = pairs.subquery()
+        destinations = func.string_agg(pairs.c.destination, aggregate_order_by(literal(", "), pairs.c.destination))
+    else:
+        pairs = pairs.order_by(association.c.passport_id, models.Voyage.destination).subquery()
+        destinations = func.group_concat(pairs.c.destination, ", ")
+
+    return select(pairs.c.passport_id, destinations.label("destinations")).group_by(pairs.c.passport_id).subquery()
 
+def filter_data(db: Session, destination: Optional[str], user_id: Optional[int], first_name: Optional[str], last_name: Optional[str]):
+    """
+    Yields one tuple per matching passport, in EXPORT_COLUMNS order.
+    Destinations are aggregated in SQL and the destination filter is an EXISTS,
+    so each passport comes back exactly once. Rows are read with yield_per
+    (a server-side cursor on Postgres), so memory stays flat regardless of the export size.
+    """
+    conditions = []
+    if user_id is not None:
+        conditions.append(models.Passport.owner_id == user_id)
     if first_name:
-        query = query.filter(models.Passport.first_name.ilike(f"%{first_name}%"))
+        conditions.append(models.Passport.first_name.ilike(f"%{first_name}%"))
     if last_name:
-        query = query.filter(models.Passport.last_name.ilike(f"%{last_name}%"))
+        conditions.append(models.Passport.last_name.ilike(f"%{last_name}%"))
+
+    columns = [getattr(models.Passport, name) for name in EXPORT_COLUMNS[:-1]]
+    if destination:
+        # The export labels every row with the requested destination.
+        query = db.query(*columns, literal(destination).label("destination")).filter(
+            models.Passport.voyages.any(models.Voyage.destination.ilike(f"%{destination}%"))
+        )
+    else:
+        destinations = _destinations_subquery(db, conditions)
+        query = db.query(*columns, func.coalesce(destinations.c.destinations, "N/A")).outerjoin(
+            destinations, destinations.c.passport_id == models.Passport.id
+        )
 
-    query = query.options(joinedload(models.Passport.voyages))
-    
-    results = query.all()
-    
-    data_list = []
-    processed_passport_ids = set()
+    query = query.filter(*conditions).order_by(models.Passport.id).yield_per(EXPORT_BATCH_SIZE)
+    for row in query:
+        yield tuple(row)
 
-    for passport in results:
-        if passport.id in processed_passport_ids:
-            continue
-        
-        destinations = [v.destination for v in passport.voyages]
-        if destination:
-            dest_str = destination
-        elif destinations:
-            dest_str = ", ".join(sorted(list(set(destinations))))
-        else:
-            dest_str = "N/A"
-
-        data_list.append({
-            "id": passport.id, "first_name": passport.first_name, "last_name": passport.last_name,
-            "birth_date": passport.birth_date, "delivery_date": passport.delivery_date,
-            "expiration_date": passport.expiration_date, "nationality": passport.nationality,
-            "passport_number": passport.passport_number, "owner_id": passport.owner_id,
-            "destination": dest_str
-        })
-        processed_passport_ids.add(passport.id)
-        
-    return data_list
+# --- Refresh Tokens ---
+
+def _hash_refresh_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def _new_refresh_token(user_id: int, family_id: Optional[str] = None):
+    token = secrets.token_urlsafe(32)
+    db_token = models.RefreshToken(
+        user_id=user_id,
+        token_hash=_hash_refresh_token(token),
+        family_id=family_id or secrets.token_hex(16),
+        expires_at=datetime.now(timezone.utc) + timedelta(days=auth.REFRESH_TOKEN_EXPIRE_DAYS),
+    )
+    return token, db_token
+
+def _prune_refresh_tokens_stmt(user_id: int):
+    return delete(models.RefreshToken).where(
+        models.RefreshToken.user_id == user_id,
+        models.RefreshToken.expires_at < datetime.now(timezone.utc)
+    )
+
+def create_refresh_token(db: Session, user_id: int, family_id: Optional[str] = None) -> str:
+    """Stores a new refresh token (and drops the user's expired ones). Returns the raw token."""
+    token, db_token = _new_refresh_token(user_id, family_id)
+    db.execute(_prune_refresh_tokens_stmt(user_id))
+    db.add(db_token)
+    db.commit()
+    return token
+
+async def create_refresh_token_async(db: AsyncSession, user_id: int) -> str:
+    token, db_token = _new_refresh_token(user_id)
+    await db.execute(_prune_refresh_tokens_stmt(user_id))
+    db.add(db_token)
+    await db.commit()
+    return token
+
+def get_refresh_token(db: Session, token: str):
+    return db.query(models.RefreshToken).filter(models.RefreshToken.token_hash == _hash_refresh_token(token)).first()
+
+def rotate_refresh_token(db: Session, db_token: models.RefreshToken) -> str:
+    """
+    Marks `db_token` as used and issues its successor in the same family, in one transaction.
+    Returns None if the token was already rotated (possibly by a concurrent request).
+    """
+    # Conditional update: the grace window counts from the first rotation and a token
+    # never gets a second successor, even when two refreshes race.
+    rotated = db.query(models.RefreshToken).filter(
+        models.RefreshToken.id == db_token.id, models.RefreshToken.rotated_at.is_(None)
+    ).update({models.RefreshToken.rotated_at: datetime.now(timezone.utc)}, synchronize_session=False)
+    if not rotated:
+        db.rollback()
+        return None
+    token, successor = _new_refresh_token(db_token.user_id, db_token.family_id)
+    db.add(successor)
+    db.commit()
+    return token
+
+def revoke_refresh_token_family(db: Session, family_id: str):
+    db.query(models.RefreshToken).filter(
+        models.RefreshToken.family_id == family_id, models.RefreshToken.revoked_at.is_(None)
+    ).update({models.RefreshToken.revoked_at: datetime.now(timezone.utc)}, synchronize_session=False)
+    db.commit()
+
+def _revoke_user_refresh_tokens(db: Session, user_id: int):
+    db.query(models.RefreshToken).filter(
+        models.RefreshToken.user_id == user_id, models.RefreshToken.revoked_at.is_(None)
+    ).update({models.RefreshToken.revoked_at: datetime.now(timezone.utc)}, synchronize_session=False)
 
 def create_invitation(db: Session, email: str):
     token = secrets.token_urlsafe(32)
@@ -337,7 +678,118 @@ def delete_invitation(db: Session, invitation_id: int):
         db.commit()
     return db_invitation
 
-def get_destinations_by_user_id(db: Session, user_id: int) -> List[str]:
-    query = db.query(models.Voyage.destination).filter(models.Voyage.user_id == user_id).distinct()
-    destinations = [item[0] for item in query.all()]
-    return destinations
+# --- Delta sync ---
+
+def get_passport_changes(db: Session, owner_id: Optional[int], since: Optional[datetime]):
+    """
+    Returns (passports updated after `since`, ids of passports deleted after `since`),
+    optionally limited to one owner. Both lookups use the (owner_id, timestamp) indexes.
+    Without `since` every passport is returned and there are no deletions.
+    """
+    upserted = db.query(models.Passport).options(selectinload(models.Passport.voyages))
+    if owner_id is not None:
+        upserted = upserted.filter(models.Passport.owner_id == owner_id)
+    if since is None:
+        return upserted.order_by(models.Passport.id).all(), []
+
+    upserted = upserted.filter(models.Passport.updated_at > since).order_by(models.Passport.updated_at).all()
+    deleted = db.query(models.PassportTombstone.passport_id).filter(models.PassportTombstone.deleted_at > since)
+    if owner_id is not None:
+        deleted = deleted.filter(models.PassportTombstone.owner_id == owner_id)
+    # An id can be reused after a delete; the live row wins.
+    live_ids = {passport.id for passport in upserted}
+    return upserted, sorted({row[0] for row in deleted.all()} - live_ids)
+
+def get_oldest_tombstone_cutoff() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+
+# --- Change versions for conditional GETs ---
+
+def _global_version_stmt():
+    # Changes whenever any owner's data changes, a user is added/removed, or a user row is edited.
+    return select(
+        func.count(models.User.id), func.coalesce(func.sum(models.User.data_version), 0),
+        func.max(models.User.id), func.max(models.User.updated_at)
+    )
+
+def get_global_version(db: Session) -> tuple:
+    return tuple(db.execute(_global_version_stmt()).one())
+
+async def get_global_version_async(db: AsyncSession) -> tuple:
+    result = await db.execute(_global_version_stmt())
+    return tuple(result.one())
+
+# The authenticated user is cached, so per-owner versions are always read fresh.
+def get_user_data_version(db: Session, user_id: int) -> int:
+    return db.execute(select(models.User.data_version).filter(models.User.id == user_id)).scalar() or 0
+
+async def get_user_data_version_async(db: AsyncSession, user_id: int) -> int:
+    result = await db.execute(select(models.User.data_version).filter(models.User.id == user_id))
+    return result.scalar() or 0
+
+# --- Async read helpers (used by the non-blocking GET routes) ---
+
+def _user_filter_clause(user_filter: str):
+    return (
+        models.User.first_name.ilike(f"%{user_filter}%") |
+        models.User.last_name.ilike(f"%{user_filter}%") |
+        models.User.user_name.ilike(f"%{user_filter}%")
+    )
+
+async def get_user_by_username_async(db: AsyncSession, username: str):
+    result = await db.execute(select(models.User).filter(models.User.user_name == username))
+    return result.scalars().first()
+
+async def get_user_with_relations_async(db: AsyncSession, user_id: int):
+    # The async session cannot lazy-load, so everything schemas.User serializes is loaded up front.
+    stmt = (
+        select(models.User)
+        .filter(models.User.id == user_id)
+        .options(
+            selectinload(models.User.passports).selectinload(models.Passport.voyages),
+            selectinload(models.User.voyages),
+        )
+        .execution_options(populate_existing=True)
+    )
+    result = await db.execute(stmt)
+    return result.scalars().first()
+
+async def get_passports_async(db: AsyncSession, skip: int = 0, limit: int = 100, user_filter: Optional[str] = None, voyage_filter: Optional[str] = None):
+    stmt = select(models.Passport).options(selectinload(models.Passport.voyages))
+    if user_filter:
+        if user_filter.isdigit():
+            stmt = stmt.filter(models.Passport.owner_id == int(user_filter))
+        else:
+            stmt = stmt.join(models.Passport.owner).filter(_user_filter_clause(user_filter))
+    if voyage_filter:
+        stmt = stmt.join(models.Passport.voyages)
+        if voyage_filter.isdigit():
+            stmt = stmt.filter(models.Voyage.id == int(voyage_filter))
+        else:
+            stmt = stmt.filter(models.Voyage.destination.ilike(f"%{voyage_filter}%"))
+    result = await db.execute(stmt.offset(skip).limit(limit))
+    return result.scalars().all()
+
+async def get_passports_by_user_async(db: AsyncSession, user_id: int):
+    stmt = select(models.Passport).filter(models.Passport.owner_id == user_id).options(selectinload(models.Passport.voyages))
+    result = await db.execute(stmt)
+    return result.scalars().all()
+
+async def get_voyages_async(db: AsyncSession, skip: int = 0, limit: int = 100, user_filter: Optional[str] = None):
+    stmt = select(models.Voyage)
+    if user_filter:
+        if user_filter.isdigit():
+            stmt = stmt.filter(models.Voyage.user_id == int(user_filter))
+        else:
+            stmt = stmt.join(models.Voyage.user).filter(_user_filter_clause(user_filter))
+    result = await db.execute(stmt.offset(skip).limit(limit))
+    return result.scalars().all()
+
+async def get_voyages_by_user_async(db: AsyncSession, user_id: int):
+    result = await db.execute(select(models.Voyage).filter(models.Voyage.user_id == user_id))
+    return result.scalars().all()
+
+async def get_destinations_by_user_id_async(db: AsyncSession, user_id: int) -> List[str]:
+    stmt = select(models.Voyage.destination).filter(models.Voyage.user_id == user_id).distinct()
+    result = await db.execute(stmt)
+    return list(result.scalars().all())
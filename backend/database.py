@@ -1,16 +1,136 @@
 # /database.py
-from sqlalchemy import create_engine
+import os
+import time
+import logging
+import threading
+from sqlalchemy import create_engine, event, text, Insert, Update, Delete
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+import query_metrics
+
+logger = logging.getLogger(__name__)
 
 # SQLALCHEMY_DATABASE_URL = "sqlite:///./data/travel_app.db" # for deployment
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./travel_app.db"
 
+# Optional read replica. GET routes read from it when set and healthy, e.g.
+# "sqlite:///./travel_app_replica.db" locally or a streaming Postgres standby.
+SQLALCHEMY_REPLICA_URL = os.getenv("SQLALCHEMY_REPLICA_URL")
+REPLICA_HEALTH_CHECK_INTERVAL = float(os.getenv("REPLICA_HEALTH_CHECK_INTERVAL", "10"))
+
+def _connect_args(url: str) -> dict:
+    return {"check_same_thread": False} if url.startswith("sqlite") else {}
+
+def _to_async_url(url: str) -> str:
+    """Maps a sync database URL onto its async driver (aiosqlite / asyncpg)."""
+    if url.startswith("sqlite:///"):
+        return url.replace("sqlite:///", "sqlite+aiosqlite:///", 1)
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    return url
+
+# pool_pre_ping: long-lived worker processes otherwise hit connections the server has dropped.
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL, connect_args=_connect_args(SQLALCHEMY_DATABASE_URL), pool_pre_ping=True
 )
+replica_engine = None
+if SQLALCHEMY_REPLICA_URL:
+    replica_engine = create_engine(
+        SQLALCHEMY_REPLICA_URL, connect_args=_connect_args(SQLALCHEMY_REPLICA_URL), pool_pre_ping=True
+    )
+
+# Async engines pointing at the same databases, used by the non-blocking read routes.
+async_engine = create_async_engine(_to_async_url(SQLALCHEMY_DATABASE_URL))
+async_replica_engine = None
+if SQLALCHEMY_REPLICA_URL:
+    async_replica_engine = create_async_engine(_to_async_url(SQLALCHEMY_REPLICA_URL), pool_pre_ping=True)
+
+for _engine in (engine, replica_engine, async_engine.sync_engine, async_replica_engine.sync_engine if async_replica_engine else None):
+    if _engine is not None:
+        query_metrics.instrument(_engine)
+
+
+class ReplicaHealth:
+    """
+    Caches the result of a periodic `SELECT 1` against the replica.
+    The probe runs on a background thread, so routing a query only reads the cached
+    flag and never waits on a slow or unreachable replica (which, from the async
+    routes, would stall the event loop).
+    """
+
+    def __init__(self, check_engine, interval: float):
+        self.check_engine = check_engine
+        self.interval = interval
+        self._healthy = False
+        self._lock = threading.Lock()
+        self._thread_pid = None
+
+    def is_healthy(self) -> bool:
+        if self.check_engine is None:
+            return False
+        self._ensure_thread()
+        return self._healthy
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so each (gunicorn/celery) process starts its own.
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid != os.getpid():
+                self._thread_pid = os.getpid()
+                threading.Thread(target=self._run, name="replica-health", daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._healthy = self._probe()
+            time.sleep(self.interval)
+
+    def _probe(self) -> bool:
+        try:
+            with self.check_engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return True
+        except Exception as e:
+            logger.warning(f"Read replica unavailable, falling back to primary: {e}")
+            return False
+
+replica_health = ReplicaHealth(replica_engine, REPLICA_HEALTH_CHECK_INTERVAL)
+
+
+class RoutingSession(Session):
+    """
+    Sends reads to the replica and everything else to the primary.
+    Once a session has flushed a write it sticks to the primary, so a request
+    always reads its own writes.
+    """
+    primary_bind = engine
+    replica_bind = replica_engine
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if (
+            self.replica_bind is None
+            or self._flushing
+            or self.info.get("use_primary")
+            or isinstance(clause, (Insert, Update, Delete))
+            or not replica_health.is_healthy()
+        ):
+            return self.primary_bind
+        return self.replica_bind
+
+class AsyncRoutingSession(RoutingSession):
+    primary_bind = async_engine.sync_engine
+    replica_bind = async_replica_engine.sync_engine if async_replica_engine is not None else None
+
+@event.listens_for(RoutingSession, "after_flush")
+def _stick_to_primary(session, flush_context):
+    session.info["use_primary"] = True
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, class_=RoutingSession)
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, class_=AsyncSession, sync_session_class=AsyncRoutingSession)
 
 Base = declarative_base()
 
@@ -19,4 +139,21 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_primary_db():
+    """Async session that never reads from the replica, for reads that must see a just-committed write."""
+    async with AsyncSessionLocal() as db:
+        db.sync_session.info["use_primary"] = True
+        yield db
@@ -0,0 +1,217 @@
+# backend/export_service.py
+
+import io
+import os
+import csv
+import json
+import time
+import uuid
+import tempfile
+from datetime import date
+from typing import Iterator, List, Optional, Tuple
+import crud
+from database import ReadSessionLocal
+
+# Flush the CSV / NDJSON buffer to the client once it holds this many characters.
+CSV_CHUNK_SIZE = 64 * 1024
+PARQUET_ROW_GROUP_SIZE = 50_000
+# XLSX has to be zipped as a whole, so it is spooled; small exports stay in memory.
+XLSX_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+FILE_CHUNK_SIZE = 256 * 1024
+
+# Spool for background export jobs; must be shared by the API and the workers.
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+EXPORT_RETENTION_HOURS = float(os.getenv("EXPORT_RETENTION_HOURS", "24"))
+
+
+def iter_export_rows(destination: Optional[str], user_id: Optional[int], first_name: Optional[str], last_name: Optional[str]) -> Iterator[Tuple]:
+    """
+    Streams export rows straight from the database cursor.
+    The generator owns its session: request-scoped sessions are closed before
+    a StreamingResponse starts sending.
+    """
+    db = ReadSessionLocal()
+    try:
+        yield from crud.filter_data(db, destination, user_id, first_name, last_name)
+    finally:
+        db.close()
+
+
+def stream_csv(rows: Iterator[Tuple]) -> Iterator[str]:
+    """Writes the header, then the rows, yielding the CSV in ~CSV_CHUNK_SIZE pieces."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(crud.EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CSV_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_ndjson(rows: Iterator[Tuple]) -> Iterator[str]:
+    """One JSON object per line, keyed by EXPORT_COLUMNS."""
+    buffer = io.StringIO()
+    for row in rows:
+        record = {column: (value.isoformat() if isinstance(value, date) else value) for column, value in zip(crud.EXPORT_COLUMNS, row)}
+        buffer.write(json.dumps(record, ensure_ascii=False))
+        buffer.write("\n")
+        if buffer.tell() >= CSV_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only sink that hands written bytes back to the generator and keeps an absolute position for Arrow."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _parquet_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("id", pa.int64()), ("first_name", pa.string()), ("last_name", pa.string()),
+        ("birth_date", pa.date32()), ("delivery_date", pa.date32()), ("expiration_date", pa.date32()),
+        ("nationality", pa.string()), ("passport_number", pa.string()), ("owner_id", pa.int64()),
+        ("destination", pa.string()),
+    ])
+
+
+def _parquet_table(batch: list, schema):
+    import pyarrow as pa
+    columns = list(zip(*batch))
+    return pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema)
+
+
+def stream_parquet(rows: Iterator[Tuple]) -> Iterator[bytes]:
+    """Writes one Parquet row group per PARQUET_ROW_GROUP_SIZE rows and yields the bytes as they are produced."""
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= PARQUET_ROW_GROUP_SIZE:
+                writer.write_table(_parquet_table(batch, schema))
+                batch = []
+                yield sink.drain()
+        if batch:
+            writer.write_table(_parquet_table(batch, schema))
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def stream_xlsx(rows: Iterator[Tuple]) -> Iterator[bytes]:
+    """
+    Builds the workbook with openpyxl's write-only mode (rows are written out as
+    they arrive, memory stays flat), then streams the finished file.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("passeports")
+    sheet.append(list(crud.EXPORT_COLUMNS))
+    for row in rows:
+        sheet.append(list(row))
+
+    with tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_MAX_SIZE) as spool:
+        workbook.save(spool)
+        spool.seek(0)
+        while chunk := spool.read(FILE_CHUNK_SIZE):
+            yield chunk
+
+
+# format -> (media type, file extension, writer)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv", stream_csv),
+    "ndjson": ("application/x-ndjson", "ndjson", stream_ndjson),
+    "parquet": ("application/vnd.apache.parquet", "parquet", stream_parquet),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx", stream_xlsx),
+}
+
+
+def export_path(job_id: str, export_format: str) -> str:
+    return os.path.join(EXPORT_DIR, f"{job_id}.{EXPORT_FORMATS[export_format][1]}")
+
+
+def _job_record_path(job_id: str) -> str:
+    return os.path.join(EXPORT_DIR, f"{job_id}.json")
+
+
+def create_job_record(owner_id: int, export_format: str, filename: str) -> str:
+    """
+    Writes the record of a new export job (owner, format, file name) to the spool and
+    returns the job id to enqueue it under. The API only serves job ids recorded here.
+    """
+    job_id = str(uuid.uuid4())
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    with open(_job_record_path(job_id), "w") as f:
+        json.dump({"owner_id": owner_id, "format": export_format, "filename": filename}, f)
+    return job_id
+
+
+def get_job_record(job_id: str) -> Optional[dict]:
+    """Returns the record written by create_job_record, or None for any other id."""
+    try:
+        uuid.UUID(job_id)
+        with open(_job_record_path(job_id)) as f:
+            return json.load(f)
+    except (ValueError, OSError):
+        return None
+
+
+def write_export(path: str, export_format: str, rows: Iterator[Tuple]):
+    """Writes a full export to `path` atomically (via a .part file)."""
+    writer = EXPORT_FORMATS[export_format][2]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    part_path = f"{path}.part"
+    with open(part_path, "wb") as f:
+        for chunk in writer(rows):
+            f.write(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+    os.replace(part_path, path)
+
+
+def purge_expired_exports():
+    """Removes spooled export files and job records older than EXPORT_RETENTION_HOURS."""
+    if not os.path.isdir(EXPORT_DIR):
+        return
+    cutoff = time.time() - EXPORT_RETENTION_HOURS * 3600
+    for entry in os.scandir(EXPORT_DIR):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
@@ -0,0 +1,143 @@
+# /idempotency.py
+"""
+Idempotency-Key support for the create endpoints.
+
+The first request with a given key reserves it in Redis, runs, and stores its
+response for IDEMPOTENCY_TTL_SECONDS; a retry with the same key gets that stored
+response back (with an Idempotent-Replayed header) instead of doing the work
+again. A duplicate that arrives while the first request is still running waits
+for its result. Keys are scoped per user and route, and reusing a key with a
+different request gets 422. Only successful responses are stored: on an error
+the key is released so the client can retry. If Redis cannot be reached,
+requests run without the guard.
+"""
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+import redis.asyncio as aioredis
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from fastapi.responses import Response
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_REDIS_URL = os.getenv("IDEMPOTENCY_REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+# A reservation left by a crashed request expires after this long.
+IDEMPOTENCY_LOCK_SECONDS = 120
+# How long a duplicate waits for the first request before giving up with 409.
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# After a Redis error, run requests unguarded for this many seconds.
+IDEMPOTENCY_REDIS_RETRY_SECONDS = 5
+
+
+def fingerprint(params) -> str:
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, redis_url: str):
+        self._aredis = aioredis.Redis.from_url(redis_url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        self._redis_down_until = 0.0
+
+    @staticmethod
+    def _key(user_id: int, scope: str, idempotency_key: str) -> str:
+        digest = hashlib.sha256(idempotency_key.encode()).hexdigest()
+        return f"idempotency:{user_id}:{scope}:{digest}"
+
+    @staticmethod
+    def _replay(entry: dict) -> Response:
+        return Response(
+            content=entry["body"],
+            status_code=entry["status_code"],
+            media_type=entry.get("media_type"),
+            headers={"Idempotent-Replayed": "true"},
+        )
+
+    async def _reserve(self, key: str, request_fingerprint: str) -> Optional[dict]:
+        """Reserves `key`, or returns the finished entry of an earlier request (waiting for it if needed)."""
+        pending = json.dumps({"state": "pending", "fingerprint": request_fingerprint})
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        delay = 0.05
+        while True:
+            if await self._aredis.set(key, pending, nx=True, ex=IDEMPOTENCY_LOCK_SECONDS):
+                return None
+            raw = await self._aredis.get(key)
+            if raw is None:
+                # Released (the first request failed) or expired in between: try to take it.
+                continue
+            entry = json.loads(raw)
+            if entry["fingerprint"] != request_fingerprint:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="Cette clé d'idempotence a déjà été utilisée pour une autre requête.",
+                )
+            if entry["state"] == "done":
+                return entry
+            if time.monotonic() >= deadline:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Une requête avec cette clé d'idempotence est toujours en cours.",
+                    headers={"Retry-After": "5"},
+                )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+    async def run(self, idempotency_key: Optional[str], user_id: int, scope: str, params,
+                  produce: Callable[[], Awaitable[Response]]) -> Response:
+        """Runs `produce` at most once per (user, scope, key); without a key it just runs it."""
+        if idempotency_key is None:
+            return await produce()
+        if not idempotency_key or len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="En-tête Idempotency-Key invalide.")
+        if time.monotonic() < self._redis_down_until:
+            return await produce()
+
+        key = self._key(user_id, scope, idempotency_key)
+        request_fingerprint = fingerprint(params)
+        try:
+            entry = await self._reserve(key, request_fingerprint)
+        except HTTPException:
+            raise
+        except Exception as e:
+            self._redis_down_until = time.monotonic() + IDEMPOTENCY_REDIS_RETRY_SECONDS
+            logger.warning(f"Idempotency check skipped, Redis unavailable: {e}")
+            return await produce()
+        if entry is not None:
+            return self._replay(entry)
+
+        stored = False
+        try:
+            response = await produce()
+            if 200 <= response.status_code < 300:
+                done = {
+                    "state": "done", "fingerprint": request_fingerprint, "status_code": response.status_code,
+                    "media_type": response.media_type, "body": response.body.decode(),
+                }
+                try:
+                    await self._aredis.set(key, json.dumps(done), ex=IDEMPOTENCY_TTL_SECONDS)
+                    stored = True
+                except Exception as e:
+                    logger.warning(f"Could not store idempotent response: {e}")
+            return response
+        finally:
+            if not stored:
+                try:
+                    await self._aredis.delete(key)
+                except Exception as e:
+                    logger.warning(f"Could not release idempotency key: {e}")
+
+
+_store = IdempotencyStore(IDEMPOTENCY_REDIS_URL)
+
+async def run(idempotency_key: Optional[str], user_id: int, scope: str, params,
+              produce: Callable[[], Awaitable[Response]]) -> Response:
+    return await _store.run(idempotency_key, user_id, scope, params, produce)
@@ -0,0 +1,127 @@
+# backend/import_service.py
+
+import io
+import os
+import csv
+import json
+import uuid
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
+from pydantic import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+import crud
+import schemas
+import export_service
+from database import SessionLocal
+
+# Rows validated and written per transaction; keeps every IN (...) under SQLite's limit.
+IMPORT_CHUNK_SIZE = 500
+# Uploads larger than this are handed to a Celery worker instead of being imported in the request.
+IMPORT_SYNC_MAX_BYTES = int(os.getenv("IMPORT_SYNC_MAX_BYTES", str(5 * 1024 * 1024)))
+# Only the first errors are reported in detail; the rest are just counted.
+IMPORT_MAX_REPORTED_ERRORS = 1000
+
+# Must be shared by the API and the workers, like the export spool.
+IMPORT_DIR = os.getenv("IMPORT_DIR", os.path.join(export_service.EXPORT_DIR, "imports"))
+
+IMPORT_FORMATS = ("csv", "ndjson")
+
+
+def detect_format(filename: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    extension = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    if extension in ("ndjson", "jsonl") or content_type in ("application/x-ndjson", "application/jsonl"):
+        return "ndjson"
+    if extension == "csv" or content_type == "text/csv":
+        return "csv"
+    return None
+
+
+def iter_records(stream: BinaryIO, import_format: str) -> Iterator[Tuple[int, object]]:
+    """
+    Yields (line number, record) without loading the file in memory.
+    CSV records are dicts keyed by the header (empty cells become None); a bad
+    NDJSON line yields the exception instead of a dict.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    try:
+        if import_format == "csv":
+            reader = csv.DictReader(text)
+            for record in reader:
+                yield reader.line_num, {key: (value if value != "" else None) for key, value in record.items() if key}
+        else:
+            for line_number, line in enumerate(text, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError as e:
+                    yield line_number, e
+    finally:
+        # Leave the underlying upload file open for its owner.
+        text.detach()
+
+
+def _row_error(line_number: int, record, messages: List[str]) -> dict:
+    passport_number = record.get("passport_number") if isinstance(record, dict) else None
+    return {"row": line_number, "passport_number": passport_number, "errors": messages}
+
+
+def import_passports(stream: BinaryIO, import_format: str, user_id: int,
+                     on_progress: Optional[Callable[[dict], None]] = None) -> dict:
+    """
+    Validates rows with schemas.PassportCreate and upserts them chunk by chunk,
+    one transaction per chunk. Invalid rows are reported and skipped; a chunk
+    that fails to write reports all its rows.
+    """
+    result = {"rows": 0, "created": 0, "updated": 0, "failed": 0, "errors": []}
+
+    def fail(error: dict):
+        result["failed"] += 1
+        if len(result["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+            result["errors"].append(error)
+
+    db = SessionLocal()
+    try:
+        def flush(chunk):
+            try:
+                counts = crud.bulk_upsert_passports(db, [passport for _, passport in chunk], user_id)
+            except SQLAlchemyError as e:
+                db.rollback()
+                for line_number, passport in chunk:
+                    fail(_row_error(line_number, {"passport_number": passport.passport_number}, [f"Erreur d'écriture: {e.__class__.__name__}"]))
+                return
+            result["created"] += counts["created"]
+            result["updated"] += counts["updated"]
+            if on_progress:
+                on_progress(result)
+
+        chunk = []
+        for line_number, record in iter_records(stream, import_format):
+            result["rows"] += 1
+            if not isinstance(record, dict):
+                fail(_row_error(line_number, None, [f"Ligne invalide: {record}"]))
+                continue
+            try:
+                chunk.append((line_number, schemas.PassportCreate.model_validate(record)))
+            except ValidationError as e:
+                fail(_row_error(line_number, record, [
+                    f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()
+                ]))
+                continue
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+    finally:
+        db.close()
+    return result
+
+
+def spool_upload(stream: BinaryIO, import_format: str) -> str:
+    """Copies an upload to the shared spool so a worker can import it. Returns the path."""
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    path = os.path.join(IMPORT_DIR, f"{uuid.uuid4().hex}.{import_format}")
+    with open(path, "wb") as f:
+        while chunk := stream.read(export_service.FILE_CHUNK_SIZE):
+            f.write(chunk)
+    return path
@@ -1,4 +1,5 @@
 import logging
+from sqlalchemy import inspect, text
 from database import engine, SessionLocal
 import models
 import crud
@@ -8,10 +9,36 @@ import os
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Columns added after the first release. create_all() only creates missing tables,
+# so existing databases get these through ALTER TABLE.
+ADDED_COLUMNS = {
+    "users": {"updated_at": "TIMESTAMP", "data_version": "INTEGER NOT NULL DEFAULT 0"},
+    "passports": {"updated_at": "TIMESTAMP"},
+    "voyages": {"updated_at": "TIMESTAMP"},
+}
+# Indexes on tables that already existed before they were declared.
+ADDED_INDEXES = {
+    "ix_passports_owner_id_updated_at": ("passports", "owner_id, updated_at"),
+    "ix_passports_owner_id_passport_number": ("passports", "owner_id, passport_number"),
+}
+
+def upgrade_schema():
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {column["name"] for column in inspector.get_columns(table)}
+            for name, ddl in columns.items():
+                if name not in existing:
+                    logger.info(f"Adding column {table}.{name}...")
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+        for index, (table, columns) in ADDED_INDEXES.items():
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {index} ON {table} ({columns})"))
+
 def init_db():
     logger.info("Creating initial database tables...")
     # The checkfirst=True is still a good safety measure
     models.Base.metadata.create_all(bind=engine, checkfirst=True)
+    upgrade_schema()
     logger.info("Database tables created.")
 
     db = SessionLocal()
@@ -1,24 +1,27 @@
 # backend/main.py
 import base64
 import os
-import pandas as pd
+import json
+import hashlib
+import itertools
+import uuid
 from contextlib import asynccontextmanager
 import tempfile
 from fastapi import BackgroundTasks
 from pydantic import ValidationError
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Query, Form, Request, Response, Body
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Query, Form, Request, Response, Body, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
 from fastapi.security import OAuth2PasswordRequestForm
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-import io
-from datetime import datetime, timezone
-import crud, models, schemas, auth
-from database import SessionLocal, engine, get_db
-from typing import Optional, List
-import ocr_service 
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timezone, timedelta
+import crud, schemas, auth, cache, query_metrics, export_service, import_service, admission, upload_service, idempotency
+from database import SessionLocal, engine, async_engine, get_db, get_read_db, get_async_primary_db
+from typing import Optional, List, Literal
 from celery.result import AsyncResult
-from celery_worker import celery_app, extract_document_data
+from celery_worker import celery_app, OCR_QUEUE, OCR_IMAGE_QUEUE, extract_document_data, extract_image_data, export_data_job, import_passports_job
 import logging 
 
 from slowapi import Limiter, _rate_limit_exceeded_handler
@@ -33,13 +36,40 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# INITIALIZE the limiter to identify users by their IP address
-limiter = Limiter(key_func=get_remote_address)
+# --- Rate limiting ---
+# Counters live in Redis (sliding window, updated atomically by a Lua script) so a limit
+# holds across all gunicorn workers and nodes. If Redis is unreachable, slowapi falls
+# back to per-process counters instead of failing requests.
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+RATE_LIMIT_LOGIN = os.getenv("RATE_LIMIT_LOGIN", "5/minute")
+RATE_LIMIT_REFRESH = os.getenv("RATE_LIMIT_REFRESH", "30/minute")
+RATE_LIMIT_UPLOAD = os.getenv("RATE_LIMIT_UPLOAD", "30/minute")
+RATE_LIMIT_UPLOAD_CHUNK = os.getenv("RATE_LIMIT_UPLOAD_CHUNK", "600/minute")
+RATE_LIMIT_IMPORT = os.getenv("RATE_LIMIT_IMPORT", "10/minute")
+RATE_LIMIT_EXPORT = os.getenv("RATE_LIMIT_EXPORT", "20/minute")
+
+def rate_limit_key(request: Request) -> str:
+    """Authenticated calls are limited per user, anonymous ones per IP address."""
+    authorization = request.headers.get("Authorization", "")
+    if authorization.startswith("Bearer "):
+        subject = auth.token_subject(authorization[len("Bearer "):])
+        if subject:
+            return f"user:{subject}"
+    return get_remote_address(request)
+
+limiter = Limiter(
+    key_func=get_remote_address,
+    storage_uri=RATE_LIMIT_STORAGE_URI,
+    storage_options={"socket_timeout": 0.2, "socket_connect_timeout": 0.2},
+    strategy="moving-window",
+    in_memory_fallback_enabled=True,
+    key_prefix="ratelimit",
+)
 
 
 # --- CORRECT STARTUP LOGIC ---
 # Define UPLOAD_DIR here so it's accessible globally
-UPLOAD_DIR = "uploads"
+UPLOAD_DIR = upload_service.UPLOAD_DIR
 
 # Lifespan manager to handle startup events like creating directories.
 @asynccontextmanager
@@ -53,6 +83,7 @@ async def lifespan(app: FastAPI):
     yield
     
     # This code runs on shutdown.
+    await async_engine.dispose()
     logger.info("Application shutdown.")
 
 
@@ -72,22 +103,86 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Disposition"],
+    expose_headers=["Content-Disposition", "Server-Timing", "ETag", "Content-Range", "Accept-Ranges", "Location", "Upload-Offset", "Upload-Length", "Tus-Resumable", "Idempotent-Replayed"],
 )
 
+# --- SQL instrumentation: query count and DB time per request ---
+@app.middleware("http")
+async def sql_timing_middleware(request: Request, call_next):
+    token = query_metrics.start(f"{request.method} {request.url.path}", scope=request.scope)
+    try:
+        response = await call_next(request)
+    finally:
+        stats = query_metrics.finish(token)
+    response.headers.append("Server-Timing", stats.server_timing())
+    return response
+
+# --- Conditional GET helpers ---
+# List ETags are derived from change counters (User.data_version), never from the rows,
+# so a matching If-None-Match is answered with 304 before anything is loaded.
+def _etag(*parts) -> str:
+    digest = hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()
+    return f'W/"{digest}"'
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as required for If-None-Match.
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+# --- Cache serialization helpers ---
+# Cached responses are stored as plain JSON, so ORM rows are serialized up front.
+def _dump(schema, obj):
+    return schema.model_validate(obj).model_dump(mode="json") if obj is not None else None
+
+def _dump_list(schema, objs):
+    return [_dump(schema, obj) for obj in objs]
+
 # --- Authentication Routes ---
 @app.post("/token", response_model=schemas.Token)
-@limiter.limit("5/minute")
-def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
+@limiter.limit(RATE_LIMIT_LOGIN)
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_primary_db)):
+    # Async so that waiting on the bcrypt executor does not hold a threadpool thread.
+    # Primary, not replica: a user who has just registered must be able to log in.
+    user = await auth.authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Nom d'utilisateur ou mot de passe incorrect",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = auth.create_access_token(data={"sub": user.user_name})
-    return {"access_token": access_token, "token_type": "bearer"}
+    access_token = auth.create_access_token(data=auth.token_claims(user))
+    refresh_token = await crud.create_refresh_token_async(db, user.id)
+    return {
+        "access_token": access_token, "token_type": "bearer",
+        "refresh_token": refresh_token, "expires_in": auth.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+# Renewing an access token costs a hash lookup instead of a bcrypt verification.
+@app.post("/token/refresh", response_model=schemas.Token)
+@limiter.limit(RATE_LIMIT_REFRESH)
+def refresh_access_token(request: Request, payload: schemas.RefreshTokenRequest, db: Session = Depends(get_db)):
+    # refresh_token is None for a replay within the grace window: the client keeps its pair.
+    user, refresh_token = auth.refresh_session(db, payload.refresh_token)
+    access_token = auth.create_access_token(data=auth.token_claims(user))
+    return {
+        "access_token": access_token, "token_type": "bearer",
+        "refresh_token": refresh_token, "expires_in": auth.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+@app.post("/token/revoke", status_code=status.HTTP_204_NO_CONTENT)
+def revoke_refresh_token(payload: schemas.RefreshTokenRequest, db: Session = Depends(get_db)):
+    db_token = crud.get_refresh_token(db, payload.refresh_token)
+    if db_token:
+        crud.revoke_refresh_token_family(db, db_token.family_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 # --- User Routes ---
 @app.post("/users/", response_model=schemas.User)
@@ -115,11 +210,15 @@ def register_user(user: schemas.UserCreate, token: str = Query(...), db: Session
     return created_user
 
 @app.get("/users/me", response_model=schemas.User)
-def read_users_me(current_user: models.User = Depends(auth.get_current_active_user)):
-    return current_user
+async def read_users_me(db: AsyncSession = Depends(get_async_primary_db), current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user_async)):
+    async def load():
+        return _dump(schemas.User, await crud.get_user_with_relations_async(db, user_id=current_user.id))
+    return await cache.aget_or_load(
+        "users-me", (cache.USERS, cache.PASSPORTS, cache.VOYAGES), {"user_id": current_user.id}, load
+    )
 
 @app.put("/users/me", response_model=schemas.User)
-def update_user_me(user_update: schemas.UserUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_active_user)):
+def update_user_me(user_update: schemas.UserUpdate, db: Session = Depends(get_db), current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user)):
     return crud.update_user(db=db, user_id=current_user.id, user_update=user_update)
 
 @app.get("/admin/users/", response_model=list[schemas.User], dependencies=[Depends(auth.require_admin)])
@@ -127,7 +226,7 @@ def read_users(
     skip: int = 0,
     limit: int = 100,
     name_filter: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     users = crud.get_users(db, skip=skip, limit=limit, name_filter=name_filter)
     return users
@@ -140,7 +239,7 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
     return db_user
 
 @app.get("/admin/users/{user_id}", response_model=schemas.User, dependencies=[Depends(auth.require_admin)])
-def read_user(user_id: int, db: Session = Depends(get_db)):
+def read_user(user_id: int, db: Session = Depends(get_read_db)):
     db_user = crud.get_user(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
@@ -167,39 +266,286 @@ def create_user_by_admin(user: schemas.UserCreate, db: Session = Depends(get_db)
 
 # --- Passport Routes ---
 @app.post("/passports/", response_model=schemas.Passport)
-def create_passport(passport: schemas.PassportCreate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_active_user)):
-    return crud.create_user_passport(db=db, passport=passport, user_id=current_user.id)
+async def create_passport(
+    passport: schemas.PassportCreate,
+    db: Session = Depends(get_db),
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user_async),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    def create() -> JSONResponse:
+        db_passport = crud.create_user_passport(db=db, passport=passport, user_id=current_user.id)
+        return JSONResponse(content=schemas.Passport.model_validate(db_passport).model_dump(mode="json"))
+
+    return await idempotency.run(
+        idempotency_key, current_user.id, "create-passport", passport.model_dump(mode="json"),
+        lambda: run_in_threadpool(create)
+    )
+
+@app.post("/passports/import", response_model=schemas.ImportResult, responses={202: {"model": schemas.AsyncTaskCreateResponse}})
+@limiter.limit(RATE_LIMIT_IMPORT, key_func=rate_limit_key)
+def import_passports(
+    request: Request,
+    file: UploadFile = File(...),
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user)
+):
+    import_format = import_service.detect_format(file.filename, file.content_type)
+    if import_format is None:
+        raise HTTPException(status_code=400, detail="Format non supporté. Utilisez un fichier CSV ou NDJSON.")
+
+    # Large files are imported by a worker; follow them with GET /tasks/{task_id}/status.
+    if file.size is not None and file.size > import_service.IMPORT_SYNC_MAX_BYTES:
+        path = import_service.spool_upload(file.file, import_format)
+        task = import_passports_job.delay(path=path, import_format=import_format, user_id=current_user.id, filename=file.filename)
+        return JSONResponse(content={"task_id": task.id, "filename": file.filename}, status_code=status.HTTP_202_ACCEPTED)
+
+    return import_service.import_passports(file.file, import_format, current_user.id)
 
 @app.post("/passports/upload-and-extract/", response_model=schemas.MultiAsyncTaskResponse, status_code=status.HTTP_202_ACCEPTED)
+@limiter.limit(RATE_LIMIT_UPLOAD, key_func=rate_limit_key)
 async def upload_and_extract_passport_async(
+    request: Request,
     destination: Optional[str] = Form(None),
     files: List[UploadFile] = File(...),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
-    task_ids = []
+    # A retry with the same Idempotency-Key gets the original task ids instead of new OCR jobs.
+    params = {"destination": destination, "files": [[file.filename, file.size] for file in files]}
+    return await idempotency.run(
+        idempotency_key, current_user.id, "upload-and-extract", params,
+        lambda: _enqueue_ocr_uploads(files, destination, current_user)
+    )
+
+async def _enqueue_tracked(task, lane: str, user_id: int, **kwargs) -> str:
+    """
+    Enqueues an OCR task under a fresh id that is registered with admission control first,
+    so the worker's release can never run before the registration.
+    """
+    task_id = str(uuid.uuid4())
+    await admission.register(lane, user_id, [task_id])
+    try:
+        task.apply_async(kwargs=kwargs, task_id=task_id)
+    except Exception:
+        await admission.deregister(lane, user_id, [task_id])
+        raise
+    return task_id
+
+async def _enqueue_ocr_uploads(files: List[UploadFile], destination: Optional[str], current_user: schemas.AuthenticatedUser) -> JSONResponse:
+    # ZIP archives are expanded into their documents; only the central directory is read here.
+    archives, plain_files, skipped = [], [], []
     for file in files:
-        try:
-            # Read file content into memory instead of saving to a temp file
-            content = await file.read()
+        if upload_service.is_archive(file.filename, file.content_type):
+            archive, members, archive_skipped = await run_in_threadpool(upload_service.open_archive, file.file, file.filename)
+            archives.append((file.filename, archive, members))
+            skipped += [f"{file.filename}/{name}" for name in archive_skipped]
+        else:
+            plain_files.append(file)
+
+    def is_image(filename, content_type=None):
+        return upload_service.ocr_content_type(filename, content_type) in upload_service.IMAGE_CONTENT_TYPES
+
+    # Photos are OCR'd in batches, one task per Vision call; documents get a task each.
+    plain_image_count = sum(is_image(file.filename, file.content_type) for file in plain_files)
+    archive_image_counts = [sum(is_image(member.filename) for member in members) for _, _, members in archives]
+    archive_document_counts = [len(members) - images for (_, _, members), images in zip(archives, archive_image_counts)]
+    image_count = plain_image_count + sum(archive_image_counts)
+    document_count = len(plain_files) - plain_image_count + sum(archive_document_counts)
+    if image_count + document_count == 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Aucun document PDF ou photo trouvé dans les fichiers envoyés.")
+    image_batch_count = -(-image_count // upload_service.OCR_IMAGE_BATCH_SIZE)
+    lane_jobs = {OCR_QUEUE: document_count}
+    lane_jobs[OCR_IMAGE_QUEUE] = lane_jobs.get(OCR_IMAGE_QUEUE, 0) + image_batch_count
+    # Against the user's in-flight cap an archive counts as one batch, so a ZIP of a few
+    # hundred documents is admitted; the queue-depth check still counts every job.
+    user_jobs = {OCR_QUEUE: len(plain_files) - plain_image_count + sum(1 for count in archive_document_counts if count)}
+    user_jobs[OCR_IMAGE_QUEUE] = user_jobs.get(OCR_IMAGE_QUEUE, 0) + min(
+        image_batch_count, -(-plain_image_count // upload_service.OCR_IMAGE_BATCH_SIZE) + sum(1 for count in archive_image_counts if count)
+    )
+
+    # Refuse new work early rather than letting the OCR queue grow without bound.
+    estimated_wait = 0
+    try:
+        for lane, job_count in lane_jobs.items():
+            if job_count:
+                estimated_wait = max(estimated_wait, await admission.check(lane, current_user.id, job_count, user_jobs[lane]))
+    except admission.Rejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=f"Service de traitement saturé ({e.reason}). Réessayez dans environ {e.retry_after} secondes.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+    # Everything is extracted and read before the first job is enqueued, so a bad archive
+    # fails the request without leaving jobs from the earlier files running.
+    # Each task is reported with its `source`, the uploaded file it came from (the archive
+    # for ZIP members), so the client can tie it back to what it sent.
+    jobs = [] # (lane, task, kwargs, [(filename, spooled path or None, source)])
+    images, image_sources = [], []
+    try:
+        for archive_name, archive, members in archives:
+            # Members go to the shared upload spool; the worker reads and removes them.
+            extracted = await run_in_threadpool(upload_service.extract_members, archive, members, archive_name)
+            for name, content_type, path in extracted:
+                if content_type in upload_service.IMAGE_CONTENT_TYPES:
+                    images.append({"filename": name, "content_type": content_type, "spooled_path": path})
+                    image_sources.append(archive_name)
+                    continue
+                jobs.append((OCR_QUEUE, extract_document_data, dict(
+                    file_content=None,
+                    original_filename=name,
+                    content_type=content_type,
+                    destination=destination,
+                    user_id=current_user.id,
+                    spooled_path=path
+                ), [(name, path, archive_name)]))
+
+        for file in plain_files:
+            if is_image(file.filename, file.content_type):
+                # Photos are spooled like archive members, keeping full-resolution images
+                # out of the broker messages (a batch holds up to OCR_IMAGE_BATCH_SIZE).
+                try:
+                    path = await upload_service.spool_photo(file)
+                except HTTPException:
+                    raise
+                except Exception as e:
+                    logger.error(f"Could not spool uploaded photo: {file.filename}. Error: {e}")
+                    continue
+                images.append({"filename": file.filename, "content_type": upload_service.ocr_content_type(file.filename, file.content_type), "spooled_path": path})
+                image_sources.append(file.filename)
+                continue
+            try:
+                # Read file content into memory instead of saving to a temp file
+                content = await file.read()
+            except Exception as e:
+                logger.error(f"Could not read uploaded file: {file.filename}. Error: {e}")
+                continue
             encoded_content = base64.b64encode(content).decode('utf-8')
             # Pass the raw content to the Celery worker
-            task = extract_document_data.delay(
+            jobs.append((OCR_QUEUE, extract_document_data, dict(
                 file_content=encoded_content,
                 original_filename=file.filename,
                 content_type=file.content_type,
                 destination=destination,
                 user_id=current_user.id
-            )
-            task_ids.append({"task_id": task.id, "filename": file.filename})
+            ), [(file.filename, None, file.filename)]))
+    except BaseException:
+        upload_service.discard_files([path for job in jobs for _, path, _ in job[3] if path] + [image["spooled_path"] for image in images if image.get("spooled_path")])
+        raise
+
+    for start in range(0, len(images), upload_service.OCR_IMAGE_BATCH_SIZE):
+        batch = images[start:start + upload_service.OCR_IMAGE_BATCH_SIZE]
+        sources = image_sources[start:start + upload_service.OCR_IMAGE_BATCH_SIZE]
+        jobs.append((OCR_IMAGE_QUEUE, extract_image_data, dict(images=batch, destination=destination, user_id=current_user.id),
+                     [(image["filename"], image.get("spooled_path"), source) for image, source in zip(batch, sources)]))
+
+    # Jobs are registered with admission control before they are enqueued (see
+    # _enqueue_tracked); whatever did not make it onto the queue is deregistered.
+    job_ids = [str(uuid.uuid4()) for _ in jobs]
+    pending = {lane: [] for lane in lane_jobs}
+    for (lane, _, _, _), job_id in zip(jobs, job_ids):
+        pending[lane].append(job_id)
+    for lane, ids in pending.items():
+        await admission.register(lane, current_user.id, ids)
 
-        except Exception as e:
-            logger.error(f"Could not read uploaded file: {file.filename}. Error: {e}")
-            continue
+    task_ids = []
+    try:
+        for (lane, task, kwargs, sources), job_id in zip(jobs, job_ids):
+            try:
+                task.apply_async(kwargs=kwargs, task_id=job_id)
+            except Exception as e:
+                logger.error(f"Could not enqueue {[filename for filename, _, _ in sources]}. Error: {e}")
+                upload_service.discard_files([path for _, path, _ in sources if path])
+                continue
+            pending[lane].remove(job_id)
+            # Every photo of a batch is reported with the same task.
+            task_ids += [{"task_id": job_id, "filename": filename, "source": source} for filename, _, source in sources]
+    finally:
+        for lane, ids in pending.items():
+            await admission.deregister(lane, current_user.id, ids)
 
     if not task_ids:
         raise HTTPException(status_code=500, detail="No files could be processed.")
 
-    return JSONResponse(content={"tasks": task_ids}, status_code=status.HTTP_202_ACCEPTED)
+    return JSONResponse(content={"tasks": task_ids, "estimated_wait_seconds": estimated_wait, "skipped": skipped}, status_code=status.HTTP_202_ACCEPTED)
+
+# --- Resumable Uploads (tus-style) ---
+# POST /uploads opens a session, PATCH /uploads/{id} appends a chunk at Upload-Offset
+# (body: application/offset+octet-stream), HEAD /uploads/{id} tells where to resume,
+# and POST /uploads/{id}/complete hands the file to the OCR pipeline.
+TUS_HEADERS = {"Tus-Resumable": "1.0.0", "Cache-Control": "no-store"}
+
+def _upload_session_response(session: dict, offset: int) -> dict:
+    return {"upload_id": session["upload_id"], "filename": session["filename"], "length": session["length"], "offset": offset}
+
+@app.post("/uploads", response_model=schemas.UploadSession, status_code=status.HTTP_201_CREATED)
+def create_upload_session(upload: schemas.UploadSessionCreate, current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user)):
+    session = upload_service.create_session(current_user.id, upload.filename, upload.content_type, upload.length, upload.destination)
+    return JSONResponse(
+        content=_upload_session_response(session, 0),
+        status_code=status.HTTP_201_CREATED,
+        # Relative, so it resolves against whatever prefix the proxy serves the API under (/api/ behind nginx).
+        headers={**TUS_HEADERS, "Location": f"uploads/{session['upload_id']}", "Upload-Offset": "0", "Upload-Length": str(upload.length)},
+    )
+
+@app.head("/uploads/{upload_id}")
+def get_upload_offset(upload_id: str, current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user)):
+    session = upload_service.get_session(upload_id, current_user.id, current_user.role == "admin")
+    offset = upload_service.session_offset(session)
+    return Response(headers={**TUS_HEADERS, "Upload-Offset": str(offset), "Upload-Length": str(session["length"])})
+
+@app.patch("/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+@limiter.limit(RATE_LIMIT_UPLOAD_CHUNK, key_func=rate_limit_key)
+async def upload_chunk(
+    request: Request,
+    upload_id: str,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user_async)
+):
+    if request.headers.get("content-type") != "application/offset+octet-stream":
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Type de contenu attendu: application/offset+octet-stream")
+    session = await run_in_threadpool(upload_service.get_session, upload_id, current_user.id, current_user.role == "admin")
+    offset = await upload_service.append_chunk(session, upload_offset, request.stream())
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers={**TUS_HEADERS, "Upload-Offset": str(offset)})
+
+@app.post("/uploads/{upload_id}/complete", response_model=schemas.MultiAsyncTaskResponse, status_code=status.HTTP_202_ACCEPTED)
+async def complete_upload(upload_id: str, current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user_async)):
+    session = await run_in_threadpool(upload_service.get_session,upload_id, current_user.id, current_user.role == "admin")
+    content_type = upload_service.ocr_content_type(session["filename"], session["content_type"])
+    is_image = content_type in upload_service.IMAGE_CONTENT_TYPES
+    lane = OCR_IMAGE_QUEUE if is_image else OCR_QUEUE
+    try:
+        estimated_wait = await admission.check(lane, current_user.id, 1)
+    except admission.Rejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=f"Service de traitement saturé ({e.reason}). Réessayez dans environ {e.retry_after} secondes.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+    # The worker reads the file from the shared spool instead of a base64 copy in the broker.
+    data_path = await run_in_threadpool(upload_service.finish_session, session)
+    # Admission counts the job against the session's owner, whom the worker releases it for.
+    if is_image:
+        task_id = await _enqueue_tracked(
+            extract_image_data, lane, session["user_id"],
+            images=[{"filename": session["filename"], "content_type": content_type, "spooled_path": data_path}],
+            destination=session["destination"],
+            user_id=session["user_id"]
+        )
+    else:
+        task_id = await _enqueue_tracked(
+            extract_document_data, lane, session["user_id"],
+            file_content=None,
+            original_filename=session["filename"],
+            content_type=session["content_type"],
+            destination=session["destination"],
+            user_id=session["user_id"],
+            spooled_path=data_path
+        )
+    return JSONResponse(
+        content={"tasks": [{"task_id": task_id, "filename": session["filename"]}], "estimated_wait_seconds": estimated_wait},
+        status_code=status.HTTP_202_ACCEPTED
+    )
 
 @app.get("/tasks/{task_id}/status", response_model=schemas.AsyncTaskStatus)
 def get_task_status(task_id: str):
@@ -230,28 +576,7 @@ def cancel_task(task_id: str):
     celery_app.control.revoke(task_id, terminate=True, signal='SIGTERM')
     return JSONResponse(content={"message": "Cancellation request sent."}, status_code=202)
 
-@app.get("/export/data")
-def export_data(
-    destination: Optional[str] = None,
-    user_id: Optional[int] = None,
-    first_name: Optional[str] = None,
-    last_name: Optional[str] = None,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
-):
-    effective_user_id = current_user.id
-    if current_user.role == "admin":
-        effective_user_id = user_id
-    
-    filtered_data = crud.filter_data(db, destination, effective_user_id, first_name, last_name)
-    
-    if not filtered_data:
-        raise HTTPException(status_code=404, detail="Aucune donnée de passeport trouvée pour les critères donnés")
-    
-    df = pd.DataFrame(filtered_data)
-    stream = io.StringIO()
-    df.to_csv(stream, index=False)
-    
+def _export_filename(db: Session, current_user: schemas.AuthenticatedUser, destination: Optional[str], user_id: Optional[int], extension: str) -> str:
     filename_parts = ["passeports"]
     if destination:
         filename_parts.append(destination.replace(' ', '_').lower())
@@ -268,25 +593,165 @@ def export_data(
     else:
         filename_parts.append(f"pour_{current_user.user_name.lower()}")
 
-    filename = f"{'_'.join(filename_parts)}.csv"
+    return f"{'_'.join(filename_parts)}.{extension}"
+
+@app.get("/export/data")
+@limiter.limit(RATE_LIMIT_EXPORT, key_func=rate_limit_key)
+def export_data(
+    request: Request,
+    destination: Optional[str] = None,
+    user_id: Optional[int] = None,
+    first_name: Optional[str] = None,
+    last_name: Optional[str] = None,
+    export_format: Literal["csv", "ndjson", "parquet", "xlsx"] = Query("csv", alias="format"),
+    db: Session = Depends(get_read_db),
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user)
+):
+    effective_user_id = current_user.id
+    if current_user.role == "admin":
+        effective_user_id = user_id
+
+    version = crud.get_global_version(db) if current_user.role == "admin" else crud.get_user_data_version(db, current_user.id)
+    etag = _etag("export", current_user.id, current_user.role, version, destination, user_id, first_name, last_name, export_format)
+    if _etag_matches(request, etag):
+        return _not_modified(etag)
+    
+    rows = export_service.iter_export_rows(destination, effective_user_id, first_name, last_name)
+    # Pull the first row up front so an empty export is still a 404 and not an empty file.
+    first_row = next(rows, None)
+    if first_row is None:
+        rows.close()
+        raise HTTPException(status_code=404, detail="Aucune donnée de passeport trouvée pour les critères donnés")
+    
+    media_type, extension, writer = export_service.EXPORT_FORMATS[export_format]
+    filename = _export_filename(db, current_user, destination, user_id, extension)
         
-    response = StreamingResponse(iter([stream.getvalue()]), media_type="text/csv")
+    response = StreamingResponse(writer(itertools.chain([first_row], rows)), media_type=media_type)
     response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    response.headers["ETag"] = etag
     return response
 
+# --- Background Export Jobs ---
+def _get_export_job(job_id: str, current_user: schemas.AuthenticatedUser):
+    # Only ids created by POST /exports are served, so other task ids (OCR, import) are a 404.
+    record = export_service.get_job_record(job_id)
+    if record is None or (current_user.role != "admin" and record["owner_id"] != current_user.id):
+        raise HTTPException(status_code=404, detail="Export non trouvé")
+    return AsyncResult(job_id, app=celery_app), record
+
+@app.post("/exports", response_model=schemas.AsyncTaskCreateResponse, status_code=status.HTTP_202_ACCEPTED)
+@limiter.limit(RATE_LIMIT_EXPORT, key_func=rate_limit_key)
+def create_export_job(
+    request: Request,
+    job: schemas.ExportJobCreate,
+    db: Session = Depends(get_read_db),
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user)
+):
+    effective_user_id = current_user.id
+    if current_user.role == "admin":
+        effective_user_id = job.user_id
+
+    extension = export_service.EXPORT_FORMATS[job.format][1]
+    filename = _export_filename(db, current_user, job.destination, job.user_id, extension)
+    job_id = export_service.create_job_record(current_user.id, job.format, filename)
+    task = export_data_job.apply_async(kwargs=dict(
+        destination=job.destination,
+        user_id=effective_user_id,
+        first_name=job.first_name,
+        last_name=job.last_name,
+        export_format=job.format,
+        owner_id=current_user.id,
+        filename=filename
+    ), task_id=job_id)
+    return JSONResponse(content={"task_id": task.id, "filename": filename}, status_code=status.HTTP_202_ACCEPTED)
+
+@app.get("/exports/{job_id}", response_model=schemas.ExportJobStatus)
+def get_export_job(job_id: str, current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user)):
+    job, _ = _get_export_job(job_id, current_user)
+    response_data = {"job_id": job_id, "status": job.status}
+
+    if job.status == 'SUCCESS':
+        response_data["filename"] = job.result.get("filename")
+        response_data["rows"] = job.result.get("rows")
+    elif job.status == 'FAILURE':
+        response_data["progress"] = {"status": str(job.info)}
+    elif job.status == 'PROGRESS':
+        response_data["progress"] = {"status": job.info.get("status"), "rows": job.info.get("rows")}
+
+    return response_data
+
+@app.get("/exports/{job_id}/download")
+def download_export(job_id: str, current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user)):
+    job, record = _get_export_job(job_id, current_user)
+    if job.status != 'SUCCESS':
+        raise HTTPException(status_code=409, detail="L'export n'est pas encore prêt.")
+
+    path = export_service.export_path(job_id, record["format"])
+    if not os.path.exists(path):
+        raise HTTPException(status_code=410, detail="Le fichier d'export a expiré.")
+
+    # FileResponse answers Range / If-Range requests and sets ETag and Last-Modified,
+    # so interrupted downloads can resume.
+    media_type = export_service.EXPORT_FORMATS[record["format"]][0]
+    return FileResponse(path, media_type=media_type, filename=record["filename"])
+
 @app.get("/passports/", response_model=list[schemas.Passport])
-def read_passports(
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user),
+async def read_passports(
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_primary_db),
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user_async),
     user_filter: Optional[str] = None,
     voyage_filter: Optional[str] = None
 ):
     if current_user.role == "admin":
-        return crud.get_passports(db=db, user_filter=user_filter, voyage_filter=voyage_filter)
-    return crud.get_passports_by_user(db=db, user_id=current_user.id)
+        version = await crud.get_global_version_async(db)
+    else:
+        version = await crud.get_user_data_version_async(db, current_user.id)
+    etag = _etag("passports", current_user.id, current_user.role, version, user_filter, voyage_filter)
+    if _etag_matches(request, etag):
+        return _not_modified(etag)
+    response.headers["ETag"] = etag
+
+    async def load():
+        if current_user.role == "admin":
+            passports = await crud.get_passports_async(db=db, user_filter=user_filter, voyage_filter=voyage_filter)
+        else:
+            passports = await crud.get_passports_by_user_async(db=db, user_id=current_user.id)
+        return _dump_list(schemas.Passport, passports)
+    params = {"user_id": current_user.id, "role": current_user.role, "user_filter": user_filter, "voyage_filter": voyage_filter}
+    return await cache.aget_or_load("passports", (cache.PASSPORTS, cache.VOYAGES, cache.USERS), params, load)
+
+# Changes committed up to this long before the cursor was issued are sent again,
+# so slow concurrent transactions are not missed. Clients apply changes idempotently.
+CHANGES_OVERLAP_SECONDS = 5
+
+@app.get("/passports/changes", response_model=schemas.PassportChanges)
+def read_passport_changes(
+    since: Optional[datetime] = None,
+    user_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user)
+):
+    # Read from the primary: clients call this right after their own uploads land.
+    owner_id = current_user.id
+    if current_user.role == "admin":
+        owner_id = user_id
+
+    cursor = datetime.now(timezone.utc)
+    if since is not None:
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        if since < crud.get_oldest_tombstone_cutoff():
+            raise HTTPException(status_code=410, detail="Curseur expiré, une resynchronisation complète est nécessaire.")
+        # The timestamp columns hold naive UTC, so compare in UTC whatever offset the client sent.
+        since = since.astimezone(timezone.utc).replace(tzinfo=None) - timedelta(seconds=CHANGES_OVERLAP_SECONDS)
+
+    upserted, deleted = crud.get_passport_changes(db, owner_id=owner_id, since=since)
+    return {"upserted": upserted, "deleted": deleted, "cursor": cursor}
 
 @app.put("/passports/{passport_id}", response_model=schemas.Passport)
-def update_passport(passport_id: int, passport_update: schemas.PassportCreate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_active_user)):
+def update_passport(passport_id: int, passport_update: schemas.PassportCreate, db: Session = Depends(get_db), current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user)):
     db_passport = crud.get_passport(db, passport_id=passport_id)
     if db_passport is None:
         raise HTTPException(status_code=404, detail="Passeport non trouvé")
@@ -295,7 +760,7 @@ def update_passport(passport_id: int, passport_update: schemas.PassportCreate, d
     return crud.update_passport(db=db, passport_id=passport_id, passport_update=passport_update)
 
 @app.delete("/passports/{passport_id}", response_model=schemas.Passport)
-def delete_passport(passport_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_active_user)):
+def delete_passport(passport_id: int, db: Session = Depends(get_db), current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user)):
     db_passport = crud.get_passport(db, passport_id=passport_id)
     if db_passport is None:
         raise HTTPException(status_code=404, detail="Passeport non trouvé")
@@ -307,7 +772,7 @@ def delete_passport(passport_id: int, db: Session = Depends(get_db), current_use
 def delete_multiple_passports(
     payload: schemas.IdsList = Body(...),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user)
 ):
     if not payload.ids:
         return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -321,23 +786,52 @@ def delete_multiple_passports(
     
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
+@app.patch("/passports/batch", response_model=schemas.PassportBatchResult)
+def batch_update_passports(
+    batch: schemas.PassportBatchUpdate,
+    db: Session = Depends(get_db),
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user)
+):
+    return crud.batch_update_passports(
+        db=db,
+        batch=batch,
+        user_id=current_user.id,
+        is_admin=(current_user.role == 'admin')
+    )
+
 # --- Voyage Routes ---
 @app.post("/voyages/", response_model=schemas.Voyage)
-def create_voyage(voyage: schemas.VoyageCreate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_active_user)):
+def create_voyage(voyage: schemas.VoyageCreate, db: Session = Depends(get_db), current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user)):
     return crud.create_user_voyage(db=db, voyage=voyage, user_id=current_user.id, passport_ids=voyage.passport_ids)
 
 @app.get("/voyages/", response_model=list[schemas.Voyage])
-def read_voyages(
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user),
+async def read_voyages(
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_primary_db),
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user_async),
     user_filter: Optional[str] = None
 ):
     if current_user.role == "admin":
-        return crud.get_voyages(db=db, user_filter=user_filter)
-    return crud.get_voyages_by_user(db=db, user_id=current_user.id)
+        version = await crud.get_global_version_async(db)
+    else:
+        version = await crud.get_user_data_version_async(db, current_user.id)
+    etag = _etag("voyages", current_user.id, current_user.role, version, user_filter)
+    if _etag_matches(request, etag):
+        return _not_modified(etag)
+    response.headers["ETag"] = etag
+
+    async def load():
+        if current_user.role == "admin":
+            voyages = await crud.get_voyages_async(db=db, user_filter=user_filter)
+        else:
+            voyages = await crud.get_voyages_by_user_async(db=db, user_id=current_user.id)
+        return _dump_list(schemas.Voyage, voyages)
+    params = {"user_id": current_user.id, "role": current_user.role, "user_filter": user_filter}
+    return await cache.aget_or_load("voyages", (cache.VOYAGES, cache.USERS), params, load)
 
 @app.put("/voyages/{voyage_id}", response_model=schemas.Voyage)
-def update_voyage(voyage_id: int, voyage_update: schemas.VoyageCreate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_active_user)):
+def update_voyage(voyage_id: int, voyage_update: schemas.VoyageCreate, db: Session = Depends(get_db), current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user)):
     db_voyage = crud.get_voyage(db, voyage_id=voyage_id)
     if db_voyage is None:
         raise HTTPException(status_code=404, detail="Voyage non trouvé")
@@ -346,7 +840,7 @@ def update_voyage(voyage_id: int, voyage_update: schemas.VoyageCreate, db: Sessi
     return crud.update_voyage(db=db, voyage_id=voyage_id, voyage_update=voyage_update)
 
 @app.delete("/voyages/{voyage_id}", response_model=schemas.Voyage)
-def delete_voyage(voyage_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_active_user)):
+def delete_voyage(voyage_id: int, db: Session = Depends(get_db), current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user)):
     db_voyage = crud.get_voyage(db, voyage_id=voyage_id)
     if db_voyage is None:
         raise HTTPException(status_code=404, detail="Voyage non trouvé")
@@ -354,26 +848,51 @@ def delete_voyage(voyage_id: int, db: Session = Depends(get_db), current_user: m
         raise HTTPException(status_code=403, detail="Non autorisé à supprimer ce voyage")
     return crud.delete_voyage(db=db, voyage_id=voyage_id)
 
+@app.post("/voyages/delete-multiple", status_code=status.HTTP_204_NO_CONTENT, summary="Delete multiple voyages")
+def delete_multiple_voyages(
+    payload: schemas.IdsList = Body(...),
+    db: Session = Depends(get_db),
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user)
+):
+    if not payload.ids:
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    crud.delete_voyages_by_ids(
+        db=db,
+        voyage_ids=payload.ids,
+        user_id=current_user.id,
+        is_admin=(current_user.role == 'admin')
+    )
+
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
 @app.get("/destinations/", response_model=List[str])
-def get_unique_destinations(
+async def get_unique_destinations(
     user_id: Optional[int] = Query(None),
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    db: AsyncSession = Depends(get_async_primary_db),
+    current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user_async)
 ):
     target_user_id = current_user.id
     if current_user.role == "admin" and user_id is not None:
         target_user_id = user_id
     
-    return crud.get_destinations_by_user_id(db, user_id=target_user_id)
+    async def load():
+        return await crud.get_destinations_by_user_id_async(db, user_id=target_user_id)
+    return await cache.aget_or_load("destinations", (cache.VOYAGES,), {"user_id": target_user_id}, load)
 
 # --- File Upload Route ---
 @app.post("/uploadfile/")
-async def create_upload_file(file: UploadFile = File(...), current_user: models.User = Depends(auth.get_current_active_user)):
-    file_location = os.path.join(UPLOAD_DIR, f"{current_user.user_name}_{file.filename}")
-    with open(file_location, "wb+") as file_object:
-        file_object.write(file.file.read())
-    return {"info": f"fichier '{file.filename}' sauvegardé à '{file_location}'"}
+@limiter.limit(RATE_LIMIT_UPLOAD, key_func=rate_limit_key)
+async def create_upload_file(request: Request, file: UploadFile = File(...), current_user: schemas.AuthenticatedUser = Depends(auth.get_current_active_user)):
+    sha256, file_location, size, created = await upload_service.save_upload(file)
+    return {
+        "info": f"fichier '{file.filename}' sauvegardé à '{file_location}'",
+        "sha256": sha256,
+        "size": size,
+        "already_stored": not created,
+    }
 
+# Read from the primary: the link is typically opened right after the invitation is created.
 @app.get("/invitations/{token}", response_model=schemas.Invitation)
 def get_invitation(token: str, db: Session = Depends(get_db)):
     invitation = crud.get_invitation_by_token(db, token)
@@ -395,7 +914,7 @@ def create_invitation(invitation: schemas.InvitationCreate, db: Session = Depend
     return crud.create_invitation(db=db, email=invitation.email)
 
 @app.get("/admin/invitations/", response_model=list[schemas.Invitation], dependencies=[Depends(auth.require_admin)])
-def read_invitations(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_invitations(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     invitations = crud.get_invitations(db, skip=skip, limit=limit)
     return invitations
 
@@ -415,4 +934,11 @@ def delete_invitation(invitation_id: int, db: Session = Depends(get_db)):
 
 @app.get("/admin/filterable-users", response_model=list[schemas.User], dependencies=[Depends(auth.require_admin)])
 def read_filterable_users(db: Session = Depends(get_db)):
-    return crud.get_all_users_for_filtering(db)
\ No newline at end of file
+    return cache.get_or_load(
+        "filterable-users", (cache.USERS, cache.PASSPORTS, cache.VOYAGES), {},
+        lambda: _dump_list(schemas.User, crud.get_all_users_for_filtering(db))
+    )
+
+@app.get("/admin/cache/stats", dependencies=[Depends(auth.require_admin)])
+def read_cache_stats():
+    return cache.stats()
\ No newline at end of file
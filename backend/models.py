@@ -1,10 +1,14 @@
 
 
 # /models.py
-from sqlalchemy import Boolean, Column, Integer, Float, String, Date, ForeignKey, Table, DateTime
+from sqlalchemy import Boolean, Column, Integer, Float, String, Date, ForeignKey, Table, DateTime, Index
 from sqlalchemy.orm import relationship
+from datetime import datetime, timezone
 from database import Base
 
+def _utcnow():
+    return datetime.now(timezone.utc)
+
 voyage_passport_association = Table('voyage_passport_association', Base.metadata,
     Column('voyage_id', Integer, ForeignKey('voyages.id'), primary_key=True),
     Column('passport_id', Integer, ForeignKey('passports.id'), primary_key=True)
@@ -20,8 +24,28 @@ class User(Base):
     user_name = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
     role = Column(String, default="user")
+    updated_at = Column(DateTime, default=_utcnow, onupdate=_utcnow)
+    # Bumped on every write to this user's passports or voyages; feeds the list ETags.
+    data_version = Column(Integer, default=0, nullable=False, server_default="0")
     passports = relationship("Passport", back_populates="owner", cascade="all, delete-orphan")
     voyages = relationship("Voyage", back_populates="user", cascade="all, delete-orphan")
+    refresh_tokens = relationship("RefreshToken", cascade="all, delete-orphan")
+
+class RefreshToken(Base):
+    """
+    Opaque refresh tokens (only their SHA-256 is stored). Each refresh rotates the
+    token; all tokens issued from one login share a family_id so a replayed token
+    can revoke the whole chain.
+    """
+    __tablename__ = "refresh_tokens"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=False)
+    token_hash = Column(String, unique=True, index=True, nullable=False)
+    family_id = Column(String, index=True, nullable=False)
+    created_at = Column(DateTime, default=_utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    rotated_at = Column(DateTime, nullable=True)
+    revoked_at = Column(DateTime, nullable=True)
 
 class Passport(Base):
     __tablename__ = "passports"
@@ -35,8 +59,24 @@ class Passport(Base):
     passport_number = Column(String, index=True, nullable=False) # Removed unique=True
     confidence_score = Column(Float)
     owner_id = Column(Integer, ForeignKey("users.id"))
+    updated_at = Column(DateTime, default=_utcnow, onupdate=_utcnow)
     owner = relationship("User", back_populates="passports")
     voyages = relationship("Voyage", secondary=voyage_passport_association, back_populates="passports")
+    __table_args__ = (
+        # Serves the delta-sync query (GET /passports/changes).
+        Index("ix_passports_owner_id_updated_at", "owner_id", "updated_at"),
+        # Passports are matched per owner on their number (create_user_passport, imports).
+        Index("ix_passports_owner_id_passport_number", "owner_id", "passport_number"),
+    )
+
+class PassportTombstone(Base):
+    """Records deleted passports so delta-sync clients can drop them."""
+    __tablename__ = "passport_tombstones"
+    id = Column(Integer, primary_key=True, index=True)
+    passport_id = Column(Integer, nullable=False)
+    owner_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, default=_utcnow, nullable=False)
+    __table_args__ = (Index("ix_passport_tombstones_owner_id_deleted_at", "owner_id", "deleted_at"),)
 
 
 class Voyage(Base):
@@ -44,6 +84,7 @@ class Voyage(Base):
     id = Column(Integer, primary_key=True, index=True)
     destination = Column(String, index=True, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"))
+    updated_at = Column(DateTime, default=_utcnow, onupdate=_utcnow)
     user = relationship("User", back_populates="voyages")
     passports = relationship("Passport", secondary=voyage_passport_association, back_populates="voyages")
 
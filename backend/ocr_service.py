@@ -1,45 +1,80 @@
 # backend/ocr_service.py - FIXED PROTOBUF ISSUE
 
+import io
 import re
 import os
 import json
 from datetime import datetime, timezone
-from google.cloud import vision, storage
-from google.api_core import exceptions
 from fastapi import HTTPException
 import logging
-from typing import Tuple, Optional, Dict
+from typing import Tuple, Optional, Dict, Iterator, List
+from upload_service import OCR_IMAGE_BATCH_SIZE
 
 # Use a specific logger for this module
 logger = logging.getLogger("ocr_service")
 logger.setLevel(logging.INFO)
 
 # --- Google Cloud Clients ---
+# The Google libraries are imported inside the functions that need them, so importing
+# this module (the API does, through celery_worker) stays cheap. Each worker child builds
+# its clients after the fork (worker_process_init in celery_worker.py, or on first use)
+# and keeps them for all its tasks.
 vision_client = None
 storage_client = None
+_clients_initialized = False
 GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME")
 
-try:
-    logger.info("--- [GCP] Initializing Google Cloud clients... ---")
-    if not os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
-        logger.error("🔴 [GCP] CRITICAL: GOOGLE_APPLICATION_CREDENTIALS environment variable is NOT SET.")
-        raise ValueError("GOOGLE_APPLICATION_CREDENTIALS environment variable must be set.")
-    
-    vision_client = vision.ImageAnnotatorClient()
-    storage_client = storage.Client()
-    logger.info("✅ [GCP] Google Cloud clients initialized successfully.")
-    
-    if not GCS_BUCKET_NAME:
-        logger.warning("🟡 [GCP] WARNING: GCS_BUCKET_NAME environment variable is not set.")
-    else:
-        logger.info(f"✅ [GCP] Using GCS Bucket: {GCS_BUCKET_NAME}")
+def init_clients():
+    global vision_client, storage_client, _clients_initialized
+    if _clients_initialized:
+        return
+    _clients_initialized = True
+    try:
+        from google.cloud import vision, storage
+        logger.info("--- [GCP] Initializing Google Cloud clients... ---")
+        if not os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
+            logger.error("🔴 [GCP] CRITICAL: GOOGLE_APPLICATION_CREDENTIALS environment variable is NOT SET.")
+            raise ValueError("GOOGLE_APPLICATION_CREDENTIALS environment variable must be set.")
+        
+        vision_client = vision.ImageAnnotatorClient()
+        storage_client = storage.Client()
+        logger.info("✅ [GCP] Google Cloud clients initialized successfully.")
+        
+        if not GCS_BUCKET_NAME:
+            logger.warning("🟡 [GCP] WARNING: GCS_BUCKET_NAME environment variable is not set.")
+        else:
+            logger.info(f"✅ [GCP] Using GCS Bucket: {GCS_BUCKET_NAME}")
 
-except Exception as e:
-    logger.error(f"🔴 [GCP] FAILED to initialize Google Cloud clients: {e}")
-    # The application can still run, but OCR features will fail.
+    except Exception as e:
+        logger.error(f"🔴 [GCP] FAILED to initialize Google Cloud clients: {e}")
+        # The worker can still run, but OCR features will fail.
+
+def close_clients():
+    """Closes the clients; the next call to init_clients() builds new ones."""
+    global vision_client, storage_client, _clients_initialized
+    for name, close in (("Vision", lambda: vision_client.transport.close()), ("Storage", lambda: storage_client.close())):
+        try:
+            close()
+        except AttributeError:
+            pass # never built
+        except Exception as e:
+            logger.warning(f"🟡 [GCP] Could not close {name} client: {e}")
+    vision_client = None
+    storage_client = None
+    _clients_initialized = False
+
+def reset_clients_after(error: Exception):
+    """Drops the clients after a transport failure so the next task starts from fresh connections."""
+    from google.api_core import exceptions
+    # Errors after which the connection itself is suspect, rather than the request.
+    if isinstance(error, (exceptions.ServiceUnavailable, exceptions.DeadlineExceeded, exceptions.Unauthenticated, ConnectionError)):
+        logger.warning(f"🟡 [GCP] Rebuilding Google Cloud clients after: {error}")
+        close_clients()
 
 def _upload_to_gcs(file_path: str, destination_blob_name: str) -> str:
     """Uploads a file to the GCS bucket."""
+    from google.api_core import exceptions
+    init_clients()
     logger.info(f"--- [GCS] Attempting to upload '{os.path.basename(file_path)}' to gs://{GCS_BUCKET_NAME}/{destination_blob_name} ---")
     if not GCS_BUCKET_NAME or not storage_client:
         logger.error("🔴 [GCS] Upload failed: GCS_BUCKET_NAME is not set or storage client is not initialized.")
@@ -61,6 +96,7 @@ def _upload_to_gcs(file_path: str, destination_blob_name: str) -> str:
 
 def _delete_from_gcs(gcs_uri: str):
     """Deletes a file from the GCS bucket."""
+    init_clients()
     logger.info(f"--- [GCS] Attempting to delete blob: {gcs_uri} ---")
     if not GCS_BUCKET_NAME or not storage_client:
         logger.error("🔴 [GCS] Delete failed: GCS not configured.")
@@ -80,6 +116,8 @@ def _delete_from_gcs(gcs_uri: str):
 
 def start_async_ocr_extraction(file_path: str, content_type: str) -> Tuple[str, str]:
     logger.info(f"--- [Vision] Starting async OCR extraction for '{os.path.basename(file_path)}' ---")
+    from google.cloud import vision
+    init_clients()
     if not vision_client:
         logger.error("🔴 [Vision] Cannot start OCR: Google Vision client is not initialized.")
         raise RuntimeError("Google Vision client is not initialized.")
@@ -116,6 +154,7 @@ def start_async_ocr_extraction(file_path: str, content_type: str) -> Tuple[str,
     return operation.operation.name, gcs_source_uri
 
 def get_async_ocr_results(operation_name: str) -> dict:
+    init_clients()
     if not vision_client or not storage_client:
         raise RuntimeError("Google Cloud clients are not initialized.")
         
@@ -186,33 +225,7 @@ def get_async_ocr_results(operation_name: str) -> dict:
         
         for page_response in response_json.get('responses', []):
             page_context = page_response.get('context', {})
-            actual_page_num = page_context.get('page_number', 'N/A')
-            try:
-                if page_response.get('error'):
-                    raise ValueError(page_response['error']['message'])
-                
-                full_text = page_response.get('fullTextAnnotation', {}).get('text', '')
-                if not full_text:
-                    raise ValueError("No text detected on page.")
-
-                parsed_data = _parse_passport_text(full_text)
-                
-                total_confidence, symbol_count = 0, 0
-                for page in page_response.get('fullTextAnnotation', {}).get('pages', []):
-                    for block in page.get('blocks', []):
-                        for paragraph in block.get('paragraphs', []):
-                            for word in paragraph.get('words', []):
-                                for symbol in word.get('symbols', []):
-                                    total_confidence += symbol.get('confidence', 0)
-                                    symbol_count += 1
-                
-                average_confidence = (total_confidence / symbol_count) if symbol_count > 0 else 0.0
-                parsed_data['confidence_score'] = round(average_confidence, 4)
-                logger.info(f"✅ Parsed page {actual_page_num} successfully. Confidence: {average_confidence:.2%}")
-                results.append({"page_number": actual_page_num, "data": parsed_data, "status": "SUCCESS"})
-            except Exception as e:
-                logger.warning(f"🟡 Failed to parse page {actual_page_num}: {e}")
-                results.append({"page_number": actual_page_num, "error": str(e), "status": "FAILURE"})
+            results.append(_parse_page_response(page_response, page_context.get('page_number', 'N/A')))
     
     logger.info(f"--- [GCS] Cleaning up {len(blob_list)} result blobs... ---")
     for blob in blob_list:
@@ -220,8 +233,98 @@ def get_async_ocr_results(operation_name: str) -> dict:
         
     return {"status": "SUCCESS", "results": results}
 
+def _parse_page_response(page_response: dict, page_number) -> dict:
+    """Turns one Vision response (JSON form) into a SUCCESS or FAILURE page result."""
+    try:
+        if page_response.get('error'):
+            raise ValueError(page_response['error']['message'])
+        
+        full_text = page_response.get('fullTextAnnotation', {}).get('text', '')
+        if not full_text:
+            raise ValueError("No text detected on page.")
+
+        parsed_data = _parse_passport_text(full_text)
+        
+        total_confidence, symbol_count = 0, 0
+        for page in page_response.get('fullTextAnnotation', {}).get('pages', []):
+            for block in page.get('blocks', []):
+                for paragraph in block.get('paragraphs', []):
+                    for word in paragraph.get('words', []):
+                        for symbol in word.get('symbols', []):
+                            total_confidence += symbol.get('confidence', 0)
+                            symbol_count += 1
+        
+        average_confidence = (total_confidence / symbol_count) if symbol_count > 0 else 0.0
+        parsed_data['confidence_score'] = round(average_confidence, 4)
+        logger.info(f"✅ Parsed page {page_number} successfully. Confidence: {average_confidence:.2%}")
+        return {"page_number": page_number, "data": parsed_data, "status": "SUCCESS"}
+    except Exception as e:
+        logger.warning(f"🟡 Failed to parse page {page_number}: {e}")
+        return {"page_number": page_number, "error": str(e), "status": "FAILURE"}
+
+# --- Direct image OCR ---
+# Photos skip GCS and the long-running operation: the worker downscales them and
+# sends several per synchronous batch_annotate_images call.
+# Longest side after downscaling; MRZ characters stay readable well below phone resolution.
+OCR_IMAGE_MAX_SIDE = int(os.getenv("OCR_IMAGE_MAX_SIDE", "2000"))
+OCR_IMAGE_JPEG_QUALITY = 85
+# Payload cap per batch_annotate_images call (images per call: OCR_IMAGE_BATCH_SIZE).
+OCR_IMAGE_BATCH_MAX_BYTES = 8 * 1024 * 1024
+
+def prepare_image(file_path: str) -> bytes:
+    """
+    Normalizes a photo for OCR: applies the EXIF orientation, converts to grayscale,
+    shrinks it to OCR_IMAGE_MAX_SIDE and re-encodes it as JPEG. HEIC needs pillow-heif.
+    """
+    from PIL import Image, ImageOps
+    try:
+        from pillow_heif import register_heif_opener
+        register_heif_opener()
+    except ImportError:
+        pass
+
+    with Image.open(file_path) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("L")
+        image.thumbnail((OCR_IMAGE_MAX_SIDE, OCR_IMAGE_MAX_SIDE))
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=OCR_IMAGE_JPEG_QUALITY, optimize=True)
+    return output.getvalue()
+
+def _image_batches(images: List[bytes]) -> Iterator[List[int]]:
+    batch, batch_bytes = [], 0
+    for index, content in enumerate(images):
+        if batch and (len(batch) >= OCR_IMAGE_BATCH_SIZE or batch_bytes + len(content) > OCR_IMAGE_BATCH_MAX_BYTES):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(index)
+        batch_bytes += len(content)
+    if batch:
+        yield batch
+
+def annotate_images(images: List[bytes]) -> List[dict]:
+    """Runs DOCUMENT_TEXT_DETECTION on prepared images; returns one page result per image, in order."""
+    from google.cloud import vision
+    init_clients()
+    if not vision_client:
+        logger.error("🔴 [Vision] Cannot start OCR: Google Vision client is not initialized.")
+        raise RuntimeError("Google Vision client is not initialized.")
+
+    feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+    results = [None] * len(images)
+    for batch in _image_batches(images):
+        requests = [vision.AnnotateImageRequest(image=vision.Image(content=images[i]), features=[feature]) for i in batch]
+        logger.info(f"[Vision] Sending batch_annotate_images request with {len(requests)} image(s)...")
+        response = vision_client.batch_annotate_images(requests=requests)
+        for i, image_response in zip(batch, response.responses):
+            # Same JSON shape as the async results, so the page parser is shared.
+            page_response = vision.AnnotateImageResponse.to_dict(image_response, preserving_proto_field_name=False)
+            results[i] = _parse_page_response(page_response, i + 1)
+    return results
+
 def cancel_google_ocr_operation(operation_name: str):
     try:
+        init_clients()
         if not vision_client:
             logger.error("🔴 [Vision] Vision client not initialized, cannot cancel operation.")
             return
@@ -3,5 +3,10 @@
 # Run the database initialization script
 python /app/initial_db.py
 
+# Requests arrive through nginx, which sets X-Forwarded-For. Trust it from the private
+# (docker network) ranges only, so request.client is the real client address; the rate
+# limiter keys anonymous requests on it.
+FORWARDED_ALLOW_IPS="${FORWARDED_ALLOW_IPS:-127.0.0.1,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16}"
+
 # Now, start the Gunicorn server
-exec gunicorn -w 4 -k uvicorn.workers.UvicornWorker main:app --bind 0.0.0.0:8000
\ No newline at end of file
+exec gunicorn -w 4 -k uvicorn.workers.UvicornWorker main:app --bind 0.0.0.0:8000 --forwarded-allow-ips="$FORWARDED_ALLOW_IPS"
\ No newline at end of file
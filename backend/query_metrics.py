@@ -0,0 +1,94 @@
+# /query_metrics.py
+"""
+Per-request / per-task SQL instrumentation.
+
+Cursor events on every engine add to the QueryStats of the current context
+(an HTTP request via the middleware in main.py, or a Celery task via the
+signals in celery_worker.py). Statements slower than SLOW_QUERY_THRESHOLD_MS
+are logged with the route or task name; bound parameters are never logged.
+"""
+import os
+import re
+import time
+import logging
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+
+logger = logging.getLogger("query_metrics")
+
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryStats:
+    __slots__ = ("label", "scope", "count", "total_ms")
+
+    def __init__(self, label: str, scope: Optional[dict] = None):
+        self.label = label
+        self.scope = scope
+        self.count = 0
+        self.total_ms = 0.0
+
+    @property
+    def name(self) -> str:
+        # The route is only resolved once routing ran, so it is looked up lazily.
+        route = self.scope.get("route") if self.scope else None
+        if route is not None and hasattr(route, "path"):
+            return f"{self.scope.get('method', '')} {route.path}".strip()
+        return self.label
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.total_ms:.1f};desc="{self.count} queries"'
+
+
+_current: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def start(label: str, scope: Optional[dict] = None):
+    """Starts collecting stats for the current context. Returns a token for `finish`."""
+    return _current.set(QueryStats(label, scope))
+
+def finish(token) -> Optional[QueryStats]:
+    stats = _current.get()
+    _current.reset(token)
+    return stats
+
+def current() -> Optional[QueryStats]:
+    return _current.get()
+
+
+def redact(statement: str) -> str:
+    """Collapses whitespace and masks any literal values inlined in the SQL."""
+    statement = _STRING_LITERAL.sub("'?'", statement)
+    statement = _NUMBER_LITERAL.sub("?", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info["query_start_time"].pop()) * 1000
+    stats = _current.get()
+    if stats is not None:
+        stats.count += 1
+        stats.total_ms += elapsed_ms
+    if elapsed_ms >= SLOW_QUERY_THRESHOLD_MS:
+        name = stats.name if stats is not None else "-"
+        logger.warning(f"Slow query ({elapsed_ms:.1f} ms) in {name}: {redact(statement)}")
+
+def _handle_error(exception_context):
+    # Keep the timing stack balanced when a statement fails.
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start_time"):
+        conn.info["query_start_time"].pop()
+
+def instrument(engine):
+    """Attaches the timing hooks to a sync Engine (use `.sync_engine` for async ones)."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
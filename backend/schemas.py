@@ -1,19 +1,24 @@
 # backend/schemas.py
 
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional, Any
+from pydantic import BaseModel, EmailStr, Field
+from typing import List, Optional, Any, Literal
 from datetime import date, datetime
 
+import upload_service
+
 # --- NEW: Schemas for Asynchronous Task Handling ---
 
 class AsyncTaskCreateResponse(BaseModel):
     """Response for a single task creation."""
     task_id: str
     filename: str
+    source: Optional[str] = None # uploaded file the task came from (the archive for ZIP members)
 
 class MultiAsyncTaskResponse(BaseModel):
     """Response when multiple background tasks are created."""
     tasks: List[AsyncTaskCreateResponse]
+    estimated_wait_seconds: Optional[int] = None # before the first task starts
+    skipped: List[str] = [] # archive members that are not OCR documents
 
 class AsyncTaskStatus(BaseModel):
     """Response when checking the status of a background task."""
@@ -23,6 +28,55 @@ class AsyncTaskStatus(BaseModel):
     result: Optional[Any] = None # Will contain the final result on SUCCESS/FAILURE
 
 
+# --- Schemas for resumable uploads ---
+
+class UploadSessionCreate(BaseModel):
+    filename: str
+    content_type: Optional[str] = None
+    length: int = Field(gt=0, le=upload_service.RESUMABLE_UPLOAD_MAX_BYTES) # total size in bytes
+    destination: Optional[str] = None
+
+class UploadSession(BaseModel):
+    upload_id: str
+    filename: str
+    length: int
+    offset: int # bytes received so far; the next PATCH starts here
+
+
+# --- Schemas for background export jobs ---
+
+class ExportJobCreate(BaseModel):
+    destination: Optional[str] = None
+    user_id: Optional[int] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    format: Literal["csv", "ndjson", "parquet", "xlsx"] = "csv"
+
+class ExportJobStatus(BaseModel):
+    """Response when checking the status of an export job."""
+    job_id: str
+    status: str # PENDING, STARTED, PROGRESS, SUCCESS, FAILURE
+    progress: Optional[dict] = None # e.g., {"rows": 120000}
+    filename: Optional[str] = None
+    rows: Optional[int] = None
+
+
+# --- Schemas for bulk passport imports ---
+
+class ImportRowError(BaseModel):
+    row: int # line number in the uploaded file
+    passport_number: Optional[str] = None
+    errors: List[str]
+
+class ImportResult(BaseModel):
+    """Outcome of an import; `errors` lists at most the first 1000 failed rows."""
+    rows: int
+    created: int
+    updated: int
+    failed: int
+    errors: List[ImportRowError] = []
+
+
 # --- EXISTING SCHEMAS ---
 
 class VoyageBase(BaseModel):
@@ -57,6 +111,12 @@ class Passport(PassportBase):
     class Config:
         from_attributes = True
 
+class PassportChanges(BaseModel):
+    """Delta since a cursor: rows to upsert and ids to drop. Pass `cursor` back as `since`."""
+    upserted: List[Passport]
+    deleted: List[int]
+    cursor: datetime
+
 class UserBase(BaseModel):
     first_name: str
     last_name: str
@@ -85,9 +145,24 @@ class User(UserBase):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None # access token lifetime in seconds
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
 
 class TokenData(BaseModel):
     username: Optional[str] = None
+    user_id: Optional[int] = None
+    role: Optional[str] = None
+
+class AuthenticatedUser(BaseModel):
+    """The caller as seen by the routes; cached by auth so most requests need no user query."""
+    id: int
+    user_name: str
+    role: Optional[str] = None
+    class Config:
+        from_attributes = True
 
 class InvitationCreate(BaseModel):
     email: EmailStr
@@ -107,4 +182,24 @@ class InvitationUpdate(BaseModel):
 class IdsList(BaseModel):
     ids: List[int]
 
+class PassportBatchFields(BaseModel):
+    """Fields to set on every passport of a batch; omitted or null fields are left unchanged."""
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    birth_date: Optional[date] = None
+    expiration_date: Optional[date] = None
+    delivery_date: Optional[date] = None
+    nationality: Optional[str] = None
+    confidence_score: Optional[float] = None
+
+class PassportBatchUpdate(BaseModel):
+    ids: List[int]
+    fields: Optional[PassportBatchFields] = None
+    add_destinations: List[str] = []
+    remove_destinations: List[str] = [] # applied before add_destinations
+
+class PassportBatchResult(BaseModel):
+    updated: int
+    skipped: List[int] # ids that do not exist or belong to another user
+
 User.model_rebuild()
\ No newline at end of file
@@ -0,0 +1,26 @@
+# backend/tests/test_bulk_delete.py
+import crud
+import models
+
+
+def _user(db, name):
+    db_user = models.User(email=f"{name}@example.com", user_name=name, hashed_password="-")
+    db.add(db_user)
+    db.commit()
+    return db_user
+
+
+def test_bulk_voyage_delete_bumps_linked_passport_owners(db):
+    owner, other = _user(db, "owner"), _user(db, "other")
+    passport = models.Passport(passport_number="P1", owner_id=other.id)
+    voyage = models.Voyage(destination="Rome", user_id=owner.id, passports=[passport])
+    db.add(voyage)
+    db.commit()
+    versions = {owner.id: owner.data_version, other.id: other.data_version}
+
+    assert crud.delete_voyages_by_ids(db, voyage_ids=[voyage.id], user_id=owner.id, is_admin=False) == 1
+
+    db.expire_all()
+    assert db.get(models.User, owner.id).data_version == versions[owner.id] + 1
+    assert db.get(models.User, other.id).data_version == versions[other.id] + 1
+    assert db.get(models.Passport, passport.id).voyages == []
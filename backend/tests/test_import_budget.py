@@ -0,0 +1,51 @@
+# backend/tests/test_import_budget.py
+"""
+The API process must stay cheap to start: importing main must not pull in the
+Google Cloud libraries (gRPC) or pandas, which only the Celery worker needs.
+"""
+import os
+import sys
+import json
+import subprocess
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+# Measured ~0.55 s on a laptop; the headroom absorbs slower CI machines.
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", "2.0"))
+FORBIDDEN_MODULES = ("grpc", "google.cloud.vision", "google.cloud.storage", "pandas")
+
+PROBE = (
+    "import sys, json, main; "
+    f"print(json.dumps([name for name in {FORBIDDEN_MODULES!r} if name in sys.modules]))"
+)
+
+
+def _import_main():
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        cwd=BACKEND_DIR, capture_output=True, text=True, timeout=120,
+    )
+
+
+def _total_import_seconds(importtime_output: str) -> float:
+    # Lines look like "import time:       412 |      15208 | fastapi"; summing the
+    # self column over every module gives the total time spent importing.
+    total_us = 0
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        total_us += int(line.split(":", 1)[1].split("|")[0])
+    return total_us / 1_000_000
+
+
+def test_main_does_not_import_worker_only_libraries():
+    result = _import_main()
+    assert result.returncode == 0, result.stderr[-2000:]
+    assert json.loads(result.stdout.strip().splitlines()[-1]) == []
+
+
+def test_main_import_time_within_budget():
+    result = _import_main()
+    assert result.returncode == 0, result.stderr[-2000:]
+    total = _total_import_seconds(result.stderr)
+    assert total < IMPORT_BUDGET_SECONDS, f"importing main took {total:.2f} s (budget {IMPORT_BUDGET_SECONDS} s)"
@@ -0,0 +1,73 @@
+# backend/tests/test_refresh_tokens.py
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import auth
+import crud
+import models
+
+
+@pytest.fixture
+def user(db):
+    db_user = models.User(email="user@example.com", user_name="user", hashed_password="-")
+    db.add(db_user)
+    db.commit()
+    return db_user
+
+
+def _family(db, family_id):
+    return db.query(models.RefreshToken).filter(models.RefreshToken.family_id == family_id).all()
+
+
+def _rotated_ago(db, token, seconds):
+    db_token = crud.get_refresh_token(db, token)
+    db_token.rotated_at = datetime.now(timezone.utc) - timedelta(seconds=seconds)
+    db.commit()
+
+
+def test_refresh_rotates_token(db, user):
+    token = crud.create_refresh_token(db, user.id)
+    refreshed_user, successor = auth.refresh_session(db, token)
+    assert refreshed_user.id == user.id
+    assert successor and successor != token
+    assert crud.get_refresh_token(db, token).rotated_at is not None
+
+
+def test_replay_within_grace_does_not_branch_or_extend_the_window(db, user):
+    token = crud.create_refresh_token(db, user.id)
+    auth.refresh_session(db, token)
+    family_id = crud.get_refresh_token(db, token).family_id
+
+    # Replays spaced under the grace window must neither mint successors nor restart it.
+    for _ in range(5):
+        _rotated_ago(db, token, auth.REFRESH_TOKEN_REUSE_GRACE_SECONDS - 5)
+        rotated_at = crud.get_refresh_token(db, token).rotated_at
+        refreshed_user, successor = auth.refresh_session(db, token)
+        assert refreshed_user.id == user.id
+        assert successor is None
+        assert crud.get_refresh_token(db, token).rotated_at == rotated_at
+    assert len(_family(db, family_id)) == 2
+
+
+def test_replay_after_grace_revokes_family(db, user):
+    token = crud.create_refresh_token(db, user.id)
+    _, successor = auth.refresh_session(db, token)
+    family_id = crud.get_refresh_token(db, token).family_id
+    _rotated_ago(db, token, auth.REFRESH_TOKEN_REUSE_GRACE_SECONDS + 1)
+
+    with pytest.raises(HTTPException) as exc:
+        auth.refresh_session(db, token)
+    assert exc.value.status_code == 401
+    assert all(db_token.revoked_at is not None for db_token in _family(db, family_id))
+    with pytest.raises(HTTPException):
+        auth.refresh_session(db, successor)
+
+
+def test_rotating_twice_issues_one_successor(db, user):
+    token = crud.create_refresh_token(db, user.id)
+    db_token = crud.get_refresh_token(db, token)
+    assert crud.rotate_refresh_token(db, db_token) is not None
+    assert crud.rotate_refresh_token(db, db_token) is None
+    assert len(_family(db, db_token.family_id)) == 2
@@ -0,0 +1,304 @@
+# backend/upload_service.py
+
+import os
+import re
+import json
+import time
+import uuid
+import fcntl
+import hashlib
+import zipfile
+import mimetypes
+from typing import AsyncIterator, BinaryIO, List, Optional, Tuple
+import aiofiles
+import aiofiles.os
+from fastapi import HTTPException, UploadFile, status
+from starlette.requests import ClientDisconnect
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def _extension(filename: str) -> str:
+    extension = os.path.splitext(filename or "")[1].lower()
+    return extension if extension[1:].isalnum() and len(extension) <= 10 else ""
+
+
+def content_path(sha256: str, filename: str) -> str:
+    """Uploads are stored under the hash of their bytes, so identical files are kept once."""
+    return os.path.join(UPLOAD_DIR, f"{sha256}{_extension(filename)}")
+
+
+async def _stream_to(file: UploadFile, path: str, max_bytes: int) -> Tuple[str, int]:
+    """Writes `file` to `path` chunk by chunk; returns (sha256, size). Raises 413 past `max_bytes`."""
+    digest = hashlib.sha256()
+    size = 0
+    async with aiofiles.open(path, "wb") as out:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Fichier trop volumineux (maximum {max_bytes // (1024 * 1024)} Mo).",
+                )
+            digest.update(chunk)
+            await out.write(chunk)
+    return digest.hexdigest(), size
+
+
+async def save_upload(file: UploadFile, max_bytes: Optional[int] = None) -> Tuple[str, str, int, bool]:
+    """
+    Streams `file` to disk in UPLOAD_CHUNK_SIZE pieces without blocking the event loop,
+    hashing it on the way. Returns (sha256, path, size, created); `created` is False
+    when the same bytes were already stored. Raises 413 past `max_bytes` (UPLOAD_MAX_BYTES).
+    """
+    max_bytes = max_bytes or UPLOAD_MAX_BYTES
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    part_path = os.path.join(UPLOAD_DIR, f".{uuid.uuid4().hex}.part")
+    try:
+        sha256, size = await _stream_to(file, part_path, max_bytes)
+        path = content_path(sha256, file.filename)
+        if await aiofiles.os.path.exists(path):
+            return sha256, path, size, False
+        await aiofiles.os.replace(part_path, path)
+        return sha256, path, size, True
+    finally:
+        if await aiofiles.os.path.exists(part_path):
+            await aiofiles.os.remove(part_path)
+
+
+# Photos posted to the OCR upload endpoint are spooled here (not content-addressed:
+# the image task that reads a file also removes it) instead of travelling base64-encoded
+# in the broker message.
+PHOTO_DIR = os.path.join(UPLOAD_DIR, "photos")
+
+
+async def spool_photo(file: UploadFile, max_bytes: Optional[int] = None) -> str:
+    """Streams an uploaded photo to PHOTO_DIR and returns its path; the caller owns the file."""
+    os.makedirs(PHOTO_DIR, exist_ok=True)
+    path = os.path.join(PHOTO_DIR, f"{uuid.uuid4().hex}{_extension(file.filename)}")
+    try:
+        await _stream_to(file, path, max_bytes or UPLOAD_MAX_BYTES)
+    except BaseException:
+        if await aiofiles.os.path.exists(path):
+            await aiofiles.os.remove(path)
+        raise
+    return path
+
+
+# --- Resumable uploads (tus-style) ---
+# Each session is a JSON sidecar plus the bytes received so far, both in the upload
+# spool, so an interrupted upload survives API restarts and resumes at its offset.
+# The spool must be shared with the workers, which read the finished file.
+SESSION_DIR = os.path.join(UPLOAD_DIR, "sessions")
+RESUMABLE_UPLOAD_MAX_BYTES = int(os.getenv("RESUMABLE_UPLOAD_MAX_BYTES", str(200 * 1024 * 1024)))
+UPLOAD_SESSION_TTL_HOURS = float(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+
+
+def _session_paths(upload_id: str) -> Tuple[str, str]:
+    return os.path.join(SESSION_DIR, f"{upload_id}.json"), os.path.join(SESSION_DIR, f"{upload_id}.bin")
+
+
+def create_session(user_id: int, filename: str, content_type: Optional[str], length: int, destination: Optional[str]) -> dict:
+    if length > RESUMABLE_UPLOAD_MAX_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Fichier trop volumineux (maximum {RESUMABLE_UPLOAD_MAX_BYTES // (1024 * 1024)} Mo).",
+        )
+    purge_expired_sessions()
+    os.makedirs(SESSION_DIR, exist_ok=True)
+    session = {
+        "upload_id": uuid.uuid4().hex, "user_id": user_id, "filename": filename,
+        "content_type": content_type, "length": length, "destination": destination,
+    }
+    meta_path, data_path = _session_paths(session["upload_id"])
+    open(data_path, "wb").close()
+    with open(meta_path, "w") as f:
+        json.dump(session, f)
+    return session
+
+
+def get_session(upload_id: str, user_id: int, is_admin: bool = False) -> dict:
+    """Loads a session; 404 for unknown ids and for other users' sessions."""
+    meta_path, _ = _session_paths(upload_id)
+    if not re.fullmatch(r"[0-9a-f]{32}", upload_id) or not os.path.exists(meta_path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session de téléversement non trouvée")
+    with open(meta_path) as f:
+        session = json.load(f)
+    if session["user_id"] != user_id and not is_admin:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session de téléversement non trouvée")
+    return session
+
+
+def session_offset(session: dict) -> int:
+    """Bytes received so far; the file on disk is the only source of truth."""
+    return os.path.getsize(_session_paths(session["upload_id"])[1])
+
+
+async def append_chunk(session: dict, offset: int, chunks: AsyncIterator[bytes]) -> int:
+    """
+    Appends a PATCH body at `offset` and returns the new offset. The offset must match
+    the bytes already received (409). The data file is locked while writing so two
+    concurrent PATCHes cannot interleave (423). Bytes received before a disconnect are kept.
+    """
+    _, data_path = _session_paths(session["upload_id"])
+    async with aiofiles.open(data_path, "ab") as out:
+        try:
+            fcntl.flock(out.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise HTTPException(status_code=status.HTTP_423_LOCKED, detail="Un envoi est déjà en cours pour ce fichier.")
+        current = os.fstat(out.fileno()).st_size
+        if offset != current:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Décalage invalide: {offset} reçu, {current} attendu.",
+                headers={"Upload-Offset": str(current)},
+            )
+        try:
+            async for chunk in chunks:
+                if current + len(chunk) > session["length"]:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail="Les données dépassent la taille annoncée du fichier.",
+                    )
+                await out.write(chunk)
+                current += len(chunk)
+        except ClientDisconnect:
+            pass
+        await out.flush()
+    return current
+
+
+def finish_session(session: dict) -> str:
+    """Closes a complete session and hands over its data file; the caller owns it from now on."""
+    meta_path, data_path = _session_paths(session["upload_id"])
+    if session_offset(session) != session["length"]:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Le téléversement n'est pas terminé.")
+    os.remove(meta_path)
+    return data_path
+
+
+def purge_expired_sessions():
+    """Removes sessions (and their partial data) not touched for UPLOAD_SESSION_TTL_HOURS."""
+    if not os.path.isdir(SESSION_DIR):
+        return
+    cutoff = time.time() - UPLOAD_SESSION_TTL_HOURS * 3600
+    for entry in os.scandir(SESSION_DIR):
+        # A session is as old as the last write to either of its files.
+        paths = _session_paths(os.path.splitext(entry.name)[0])
+        try:
+            if max(os.path.getmtime(path) for path in paths if os.path.exists(path)) < cutoff:
+                os.remove(entry.path)
+        except (OSError, ValueError):
+            pass
+
+
+# --- ZIP archives ---
+# Archives posted to the OCR upload endpoint are read from the request's spooled file
+# (only the central directory and one member at a time are in memory) and each
+# supported member is extracted to ARCHIVE_DIR, which the workers read from.
+ARCHIVE_DIR = os.path.join(UPLOAD_DIR, "archives")
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed")
+ZIP_MAX_MEMBERS = int(os.getenv("ZIP_MAX_MEMBERS", "500"))
+ZIP_MAX_TOTAL_BYTES = int(os.getenv("ZIP_MAX_TOTAL_BYTES", str(1024 * 1024 * 1024)))
+# Scans barely compress; a member inflating more than this is treated as a zip bomb.
+ZIP_MAX_RATIO = 100
+# Content types the OCR pipeline accepts; other members are skipped. Photos go
+# through the image path (tasks.extract_image_data), PDFs through the async one.
+IMAGE_CONTENT_TYPES = {"image/jpeg", "image/png", "image/heic", "image/heif"}
+OCR_CONTENT_TYPES = {"application/pdf"} | IMAGE_CONTENT_TYPES
+# Photos per image task, each sent in one Vision batch_annotate_images call (at most 16).
+OCR_IMAGE_BATCH_SIZE = int(os.getenv("OCR_IMAGE_BATCH_SIZE", "8"))
+mimetypes.add_type("image/heic", ".heic")
+mimetypes.add_type("image/heif", ".heif")
+
+
+def ocr_content_type(filename: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    """The declared type if the pipeline knows it, else the one implied by the extension."""
+    if content_type in OCR_CONTENT_TYPES:
+        return content_type
+    return mimetypes.guess_type(filename or "")[0]
+
+
+def is_archive(filename: Optional[str], content_type: Optional[str]) -> bool:
+    return content_type in ZIP_CONTENT_TYPES or _extension(filename) == ".zip"
+
+
+def _rejected_archive(filename: str, reason: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Archive {filename} refusée: {reason}.",
+    )
+
+
+def open_archive(stream: BinaryIO, filename: str) -> Tuple[zipfile.ZipFile, List[zipfile.ZipInfo], List[str]]:
+    """
+    Reads the archive's central directory and applies the zip-bomb limits on the declared
+    sizes. Returns (archive, members to extract, names of skipped members); nothing is
+    decompressed yet. Raises 400 for unreadable archives and 413 past the limits.
+    """
+    try:
+        archive = zipfile.ZipFile(stream)
+    except (zipfile.BadZipFile, OSError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Archive {filename} illisible.")
+
+    members, skipped = [], []
+    total = 0
+    for info in archive.infolist():
+        name = os.path.basename(info.filename)
+        if info.is_dir() or not name or name.startswith(".") or info.filename.startswith("__MACOSX/"):
+            continue
+        if ocr_content_type(name, None) not in OCR_CONTENT_TYPES or info.flag_bits & 0x1:
+            # Unsupported types, nested archives and encrypted members.
+            skipped.append(info.filename)
+            continue
+        if info.file_size > UPLOAD_MAX_BYTES:
+            raise _rejected_archive(filename, f"{info.filename} dépasse {UPLOAD_MAX_BYTES // (1024 * 1024)} Mo")
+        if info.file_size > ZIP_MAX_RATIO * max(info.compress_size, 1):
+            raise _rejected_archive(filename, f"taux de compression suspect pour {info.filename}")
+        total += info.file_size
+        members.append(info)
+
+    if len(members) > ZIP_MAX_MEMBERS:
+        raise _rejected_archive(filename, f"plus de {ZIP_MAX_MEMBERS} documents")
+    if total > ZIP_MAX_TOTAL_BYTES:
+        raise _rejected_archive(filename, f"plus de {ZIP_MAX_TOTAL_BYTES // (1024 * 1024)} Mo une fois décompressée")
+    return archive, members, skipped
+
+
+def extract_members(archive: zipfile.ZipFile, members: List[zipfile.ZipInfo], filename: str) -> List[Tuple[str, str, str]]:
+    """
+    Stream-extracts `members` (from open_archive) to ARCHIVE_DIR, counting the bytes
+    actually inflated rather than trusting the headers. Returns (name, content_type, path)
+    per member; on error the files already extracted are removed. Blocking: run it in a thread.
+    """
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    extracted = []
+    try:
+        for info in members:
+            name = os.path.basename(info.filename)
+            path = os.path.join(ARCHIVE_DIR, f"{uuid.uuid4().hex}{_extension(name)}")
+            extracted.append((name, ocr_content_type(name, None), path))
+            size = 0
+            with archive.open(info) as source, open(path, "wb") as out:
+                while chunk := source.read(UPLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > info.file_size:
+                        raise _rejected_archive(filename, f"taille de {info.filename} falsifiée")
+                    out.write(chunk)
+    except zipfile.BadZipFile:
+        discard_files([path for _, _, path in extracted])
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Archive {filename} corrompue.")
+    except BaseException:
+        discard_files([path for _, _, path in extracted])
+        raise
+    return extracted
+
+
+def discard_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -3,6 +3,16 @@
 import React, { useState, useEffect, useCallback, useRef } from 'react';
 
 const API_URL = '/api';
+// Access tokens live 30 minutes; renew them a little earlier with the refresh token.
+const REFRESH_INTERVAL_MS = 25 * 60 * 1000;
+// How often each tab checks whether the shared session is due for renewal.
+const REFRESH_CHECK_MS = 60 * 1000;
+
+const storeSession = (data) => {
+    localStorage.setItem('token', data.access_token);
+    localStorage.setItem('token_refreshed_at', String(Date.now()));
+    if (data.refresh_token) localStorage.setItem('refresh_token', data.refresh_token);
+};
 
 // --- STYLES COMPONENT (Integrated, with NEW styles for progress bars) ---
 const GlobalStyles = () => (
@@ -146,19 +156,66 @@ export default function App() {
     const [token, setToken] = useState(localStorage.getItem('token'));
     const [user, setUser] = useState(null);
     const [view, setView] = useState('login');
-    const logout = useCallback(() => { localStorage.removeItem('token'); setToken(null); setUser(null); window.history.pushState({}, '', '/'); setView('login'); }, []);
+    const logout = useCallback(() => {
+        const refreshToken = localStorage.getItem('refresh_token');
+        if (refreshToken) { fetch(`${API_URL}/token/revoke`, { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ refresh_token: refreshToken }) }).catch(() => {}); }
+        localStorage.removeItem('token'); localStorage.removeItem('refresh_token'); localStorage.removeItem('token_refreshed_at'); setToken(null); setUser(null); window.history.pushState({}, '', '/'); setView('login');
+    }, []);
+    // Swaps the refresh token for a new pair; returns the new access token or null.
+    // Tabs share the session, so the swap runs under a cross-tab lock: a tab that waited
+    // for it picks up the pair another tab just obtained instead of presenting the
+    // rotated refresh token again (which the server treats as reuse).
+    const refreshSession = useCallback(async ({ onlyIfDue = false } = {}) => {
+        const seenRefreshToken = localStorage.getItem('refresh_token');
+        if (!seenRefreshToken) return null;
+        const renew = async () => {
+            const refreshToken = localStorage.getItem('refresh_token');
+            if (!refreshToken) return null;
+            const refreshedAt = Number(localStorage.getItem('token_refreshed_at') || 0);
+            if (refreshToken !== seenRefreshToken || (onlyIfDue && Date.now() - refreshedAt < REFRESH_INTERVAL_MS)) {
+                const currentToken = localStorage.getItem('token');
+                setToken(currentToken);
+                return currentToken;
+            }
+            try {
+                const response = await fetch(`${API_URL}/token/refresh`, { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ refresh_token: refreshToken }) });
+                if (!response.ok) return null;
+                const data = await response.json();
+                storeSession(data);
+                setToken(data.access_token);
+                return data.access_token;
+            } catch (error) { return null; }
+        };
+        return navigator.locks ? navigator.locks.request('session-refresh', renew) : renew();
+    }, []);
     const fetchUser = useCallback(async () => {
         const currentToken = localStorage.getItem('token');
         if (currentToken) {
             try {
-                const response = await fetch(`${API_URL}/users/me`, { headers: { 'Authorization': `Bearer ${currentToken}` } });
+                let response = await fetch(`${API_URL}/users/me`, { headers: { 'Authorization': `Bearer ${currentToken}` } });
+                if (response.status === 401) {
+                    const renewedToken = await refreshSession();
+                    if (renewedToken) response = await fetch(`${API_URL}/users/me`, { headers: { 'Authorization': `Bearer ${renewedToken}` } });
+                }
                 if (response.ok) { const data = await response.json(); setUser(data); setView('dashboard'); } else { logout(); }
             } catch (error) { console.error("Échec de la récupération de l'utilisateur:", error); logout(); }
         } else {
             const path = window.location.pathname;
             if (path.startsWith('/register/')) { setView('register'); } else { setView('login'); }
         }
-    }, [logout]);
+    }, [logout, refreshSession]);
+    useEffect(() => {
+        if (!token) return;
+        // Every tab checks, but only the first one to find the session due renews it.
+        const intervalId = setInterval(() => refreshSession({ onlyIfDue: true }), REFRESH_CHECK_MS);
+        return () => clearInterval(intervalId);
+    }, [token, refreshSession]);
+    useEffect(() => {
+        // Another tab renewed or dropped the session: follow it instead of refreshing again.
+        const handleStorage = (e) => { if (e.key === 'token') setToken(e.newValue); };
+        window.addEventListener('storage', handleStorage);
+        return () => window.removeEventListener('storage', handleStorage);
+    }, []);
     useEffect(() => {
         fetchUser();
         const handlePopState = () => fetchUser();
@@ -192,7 +249,7 @@ function Login({ setToken, fetchUser }) {
             const response = await fetch(`${API_URL}/token`, { method: 'POST', headers: { 'Content-Type': 'application/x-www-form-urlencoded' }, body: formData, });
             if (response.ok) {
                 const data = await response.json();
-                localStorage.setItem('token', data.access_token);
+                storeSession(data);
                 setToken(data.access_token);
                 fetchUser();
             } else {
@@ -370,7 +427,8 @@ function OcrUploader({ token, onUploadSuccess }) {
         e.target.value = null; // Reset file input
     };
 
-    const pollTaskStatus = useCallback((taskId, fileId) => {
+    // Photos are processed in batches, so one task can cover several files.
+    const pollTaskStatus = useCallback((taskId, fileIds) => {
         pollingIntervals.current[taskId] = setInterval(async () => {
             try {
                 const response = await fetch(`${API_URL}/tasks/${taskId}/status`, {
@@ -381,7 +439,7 @@ function OcrUploader({ token, onUploadSuccess }) {
                 const data = await response.json();
 
                 setUploadTasks(prev => prev.map(task =>
-                    task.id === fileId ? { ...task, status: data.status, progress: data.progress || task.progress, result: data.result } : task
+                    fileIds.includes(task.id) ? { ...task, status: data.status, progress: data.progress || task.progress, result: data.result } : task
                 ));
 
                 if (['SUCCESS', 'FAILURE', 'CANCELLED'].includes(data.status)) {
@@ -394,7 +452,7 @@ function OcrUploader({ token, onUploadSuccess }) {
                 clearInterval(pollingIntervals.current[taskId]);
                 delete pollingIntervals.current[taskId];
                 setUploadTasks(prev => prev.map(task =>
-                    task.id === fileId ? { ...task, status: 'FAILURE', progress: { status: 'Erreur de suivi.' } } : task
+                    fileIds.includes(task.id) ? { ...task, status: 'FAILURE', progress: { status: 'Erreur de suivi.' } } : task
                 ));
             }
         }, 5000); // Poll every 5 seconds
@@ -421,16 +479,35 @@ function OcrUploader({ token, onUploadSuccess }) {
             });
 
             if (response.status === 202) {
-                const data = await response.json(); // Expects { tasks: [{ task_id, filename }] }
-                data.tasks.forEach(createdTask => {
-                    const matchingFile = filesToUpload.find(f => f.file.name === createdTask.filename);
-                    if (matchingFile) {
-                        setUploadTasks(prev => prev.map(t =>
-                            t.id === matchingFile.id ? { ...t, taskId: createdTask.task_id, status: 'PROGRESS', progress: { status: 'En cours de traitement...' } } : t
-                        ));
-                        pollTaskStatus(createdTask.task_id, matchingFile.id);
+                const data = await response.json(); // Expects { tasks: [{ task_id, filename, source }] }
+                const filesByTask = {};
+                const taskIdByEntry = {};
+                const membersByArchive = {};
+                data.tasks.forEach((createdTask, index) => {
+                    // `source` is the file that was sent; for a ZIP it is the archive, and each
+                    // document inside it gets its own entry in place of the archive's.
+                    const matchingFile = filesToUpload.find(f => f.file.name === (createdTask.source || createdTask.filename));
+                    if (!matchingFile) return;
+                    let entryId = matchingFile.id;
+                    if (createdTask.filename !== matchingFile.file.name) {
+                        entryId = `${matchingFile.id}/${index}`;
+                        (membersByArchive[matchingFile.id] ||= []).push({
+                            id: entryId, file: { name: `${matchingFile.file.name} › ${createdTask.filename}` },
+                            status: 'PROGRESS', progress: { status: 'En cours de traitement...' }, taskId: createdTask.task_id, result: null
+                        });
+                    } else {
+                        taskIdByEntry[entryId] = createdTask.task_id;
                     }
+                    (filesByTask[createdTask.task_id] ||= []).push(entryId);
                 });
+                // Every submitted entry ends up tracked by a task or failed, never left pending.
+                setUploadTasks(prev => prev.flatMap(t => {
+                    if (membersByArchive[t.id]) return membersByArchive[t.id];
+                    if (taskIdByEntry[t.id]) return [{ ...t, taskId: taskIdByEntry[t.id], status: 'PROGRESS', progress: { status: 'En cours de traitement...' } }];
+                    if (filesToUpload.some(f => f.id === t.id)) return [{ ...t, status: 'FAILURE', progress: { status: "Aucun traitement n'a pu être créé pour ce fichier." } }];
+                    return [t];
+                }));
+                Object.entries(filesByTask).forEach(([taskId, fileIds]) => pollTaskStatus(taskId, fileIds));
             } else {
                 const errorData = await response.json();
                 setUploadTasks(prev => prev.map(t =>
@@ -497,7 +574,7 @@ function OcrUploader({ token, onUploadSuccess }) {
             </div>
             <div className="form-group">
                 <label>Documents PDF (plusieurs fichiers possibles)</label>
-                <input type="file" onChange={handleFileChange} accept="application/pdf" className="form-input" multiple disabled={isUploading} />
+                <input type="file" onChange={handleFileChange} accept="application/pdf,image/jpeg,image/png,image/heic,.heic,application/zip,.zip" className="form-input" multiple disabled={isUploading} />
             </div>
 
             <ul className="upload-list">